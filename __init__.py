@@ -24,7 +24,12 @@
 
 
 import base
+import benchmark
 import container
+import container_job
+import container_report
+import product
+import profiling
 import sale
 import stock
 import wizard
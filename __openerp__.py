@@ -24,7 +24,7 @@
 
 {
     'name': 'Container',
-    'version': '1.0',
+    'version': '1.1',
     'category': 'Generic Modules/Sales & Purchases',
     'description': """Manages containers receipt""",
     'author': 'SYLEAM',
@@ -47,10 +47,18 @@
         'workflow/workflow.xml',
         'base_view.xml',
         'container_view.xml',
+        'container_data.xml',
+        'container_job_data.xml',
+        'container_job_view.xml',
+        'container_report_data.xml',
+        'container_report_view.xml',
+        'profiling_view.xml',
         'product_view.xml',
         'sale_view.xml',
         'stock_view.xml',
         'wizard/stock_partial_container_view.xml',
+        'wizard/stock_container_transition_view.xml',
+        'wizard/stock_container_import_view.xml',
     ],
     'demo_xml': [],
     'test': [],
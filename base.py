@@ -25,6 +25,7 @@
 
 from osv import osv
 from osv import fields
+import profiling
 
 
 class res_company(osv.osv):
@@ -32,8 +33,28 @@ class res_company(osv.osv):
 
     _columns = {
         'container_updates_dates': fields.boolean('Container Updates Dates', help='Check to allow container to update dates on pickings and moves'),
+        'container_async_transitions': fields.boolean('Container Background Transitions', help='Check to run the container workflow transitions in background jobs'),
+        'container_deferred_dates': fields.boolean('Container Deferred Dates', help='Check to let a scheduled job update the dates on pickings and moves, instead of the user changing the container'),
+        'container_archive_days': fields.integer('Container Archive Delay', help='Number of days after which delivered and cancelled containers are archived, 0 to never archive them'),
+        'container_profiling': fields.boolean('Container Profiling', help='Check to record the time, queries and rows touched by the container operations'),
     }
 
+    def write(self, cr, uid, ids, values, context=None):
+        if 'container_profiling' in values:
+            profiling.clear_cache()
+        return super(res_company, self).write(cr, uid, ids, values, context=context)
+
 res_company()
 
+
+class res_users(osv.osv):
+    _inherit = 'res.users'
+
+    def write(self, cr, uid, ids, values, context=None):
+        if 'company_id' in values:
+            profiling.clear_cache()
+        return super(res_users, self).write(cr, uid, ids, values, context=context)
+
+res_users()
+
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from osv import osv
+from datetime import datetime, timedelta
+from tools.translate import _
+from profiling import query_counter
+import netsvc
+import time
+
+# Number of incoming moves of the containers created for the benchmarks
+LINE_COUNTS = [10, 100, 1000]
+# Measured operations, in the order they are run
+OPERATIONS = [
+    'compute_values',
+    'action_booking',
+    'do_partial',
+    'write_dates',
+    'check_container_availability',
+    'action_draft',
+]
+
+
+class stock_container_benchmark(osv.osv):
+    """
+    Measures the container operations on synthetic data
+    All data created by a benchmark is rolled back once measured
+    """
+    _name = 'stock.container.benchmark'
+    _description = 'Container Benchmark'
+    _auto = False
+
+    def _create_container(self, cr, uid, line_count, product_count=None, picking_count=1, context=None):
+        """
+        Creates a draft container holding line_count assigned incoming moves,
+        on product_count products, spread over picking_count incoming pickings
+        """
+        model_data_obj = self.pool.get('ir.model.data')
+        product_obj = self.pool.get('product.product')
+        picking_obj = self.pool.get('stock.picking')
+        stock_move_obj = self.pool.get('stock.move')
+        supplier_location_id = model_data_obj.get_object_reference(cr, uid, 'stock', 'stock_location_suppliers')[1]
+        stock_location_id = model_data_obj.get_object_reference(cr, uid, 'stock', 'stock_location_stock')[1]
+        container_categ_id = model_data_obj.get_object_reference(cr, uid, 'container', 'product_category_container')[1]
+        product_ids = [product_obj.create(cr, uid, {
+            'name': 'Benchmark product %d' % index,
+            'volume': 0.01,
+            'weight_net': 1.,
+        }, context=context) for index in range(product_count or line_count)]
+        uom_ids = dict([(product['id'], product['uom_id'][0]) for product in product_obj.read(cr, uid, product_ids, ['uom_id'], context=context)])
+        picking_ids = []
+        for picking_index in range(picking_count):
+            picking_ids.append(picking_obj.create(cr, uid, {
+                'name': 'Benchmark %d' % picking_index,
+                'type': 'in',
+                'move_lines': [(0, 0, {
+                    'name': 'Benchmark move %d' % index,
+                    'product_id': product_ids[index % len(product_ids)],
+                    'product_uom': uom_ids[product_ids[index % len(product_ids)]],
+                    'product_qty': 1.,
+                    'location_id': supplier_location_id,
+                    'location_dest_id': stock_location_id,
+                }) for index in range(line_count) if index % picking_count == picking_index],
+            }, context=context))
+        move_ids = stock_move_obj.search(cr, uid, [('picking_id', 'in', picking_ids)], context=context)
+        stock_move_obj.write(cr, uid, move_ids, {'state': 'assigned'}, context=context)
+        return self.pool.get('stock.container').create(cr, uid, {
+            'name': 'Benchmark',
+            'product_id': product_obj.create(cr, uid, {'name': 'Benchmark container', 'categ_id': container_categ_id, 'volume': line_count}, context=context),
+            'incoterm_id': self.pool.get('stock.incoterms').search(cr, uid, [], limit=1, context=context)[0],
+            'container_stock_location_id': supplier_location_id,
+            'destination_warehouse_id': self.pool.get('stock.warehouse').search(cr, uid, [], limit=1, context=context)[0],
+            'incoming_move_list_ids': [(6, 0, move_ids)],
+        }, context=context)
+
+    def _measure(self, cr, function, *args, **kwargs):
+        """
+        Calls the function, returns its wall time and number of queries
+        """
+        counter = query_counter(cr).start()
+        start = time.time()
+        try:
+            function(*args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            queries = counter.stop()
+        return {
+            'seconds': seconds,
+            'queries': queries,
+        }
+
+    def _book(self, cr, uid, container_id, context=None):
+        """
+        Books the container, through the workflow
+        """
+        netsvc.LocalService('workflow').trg_validate(uid, 'stock.container', container_id, 'button_booking', cr)
+
+    def _ship(self, cr, uid, container_id, context=None):
+        """
+        Returns a function sending the booked container to freight, through the partial container wizard
+        """
+        ctx = dict(context or {}, active_ids=[container_id], active_model='stock.container')
+        partial_obj = self.pool.get('stock.partial.container')
+        partial_id = partial_obj.create(cr, uid, {}, context=ctx)
+        return lambda: partial_obj.do_partial(cr, uid, [partial_id], context=ctx)
+
+    def _bench_compute_values(self, cr, uid, container_id, context=None):
+        """
+        Computes the weight and volume of the draft container
+        """
+        container_obj = self.pool.get('stock.container')
+        return self._measure(cr, container_obj._compute_values, cr, uid, [container_id], None, None, context=context)
+
+    def _bench_action_booking(self, cr, uid, container_id, context=None):
+        """
+        Books the draft container
+        """
+        return self._measure(cr, self._book, cr, uid, container_id, context=context)
+
+    def _bench_do_partial(self, cr, uid, container_id, context=None):
+        """
+        Sends the booked container to freight
+        """
+        self._book(cr, uid, container_id, context=context)
+        return self._measure(cr, self._ship(cr, uid, container_id, context=context))
+
+    def _bench_write_dates(self, cr, uid, container_id, context=None):
+        """
+        Changes the ETM date of a container in freight, with dates updated on moves and pickings
+        """
+        container_obj = self.pool.get('stock.container')
+        company_id = self.pool.get('res.users').browse(cr, uid, uid, context=context).company_id.id
+        self.pool.get('res.company').write(cr, uid, [company_id], {'container_updates_dates': True}, context=context)
+        self._book(cr, uid, container_id, context=context)
+        self._ship(cr, uid, container_id, context=context)()
+        etm_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+        return self._measure(cr, container_obj.write, cr, uid, [container_id], {'etm_date': etm_date}, context=context)
+
+    def _bench_check_container_availability(self, cr, uid, container_id, context=None):
+        """
+        Reserves the whole container content with one sale order line per move
+        """
+        sale_order_obj = self.pool.get('sale.order')
+        self._book(cr, uid, container_id, context=context)
+        partner_id = self.pool.get('res.partner').create(cr, uid, {'name': 'Benchmark', 'address': [(0, 0, {'name': 'Benchmark'})]}, context=context)
+        partner_values = sale_order_obj.onchange_partner_id(cr, uid, [], partner_id)['value']
+        container = self.pool.get('stock.container').browse(cr, uid, container_id, context=context)
+        order_id = sale_order_obj.create(cr, uid, {
+            'partner_id': partner_id,
+            'partner_invoice_id': partner_values['partner_invoice_id'],
+            'partner_order_id': partner_values['partner_order_id'],
+            'partner_shipping_id': partner_values['partner_shipping_id'],
+            'pricelist_id': partner_values['pricelist_id'],
+            'shop_id': self.pool.get('sale.shop').search(cr, uid, [], limit=1, context=context)[0],
+            'order_line': [(0, 0, {
+                'name': move.product_id.name,
+                'product_id': move.product_id.id,
+                'product_uom': move.product_uom.id,
+                'product_uom_qty': move.product_qty,
+                'price_unit': 1.,
+                'container_id': container_id,
+            }) for move in container.move_line_ids],
+        }, context=context)
+        line_ids = self.pool.get('sale.order.line').search(cr, uid, [('order_id', '=', order_id)], context=context)
+        return self._measure(cr, self.pool.get('sale.order.line').check_container_availability, cr, uid, line_ids, context=context)
+
+    def _bench_action_draft(self, cr, uid, container_id, context=None):
+        """
+        Reverts the booked container to draft
+        """
+        container_obj = self.pool.get('stock.container')
+        self._book(cr, uid, container_id, context=context)
+        return self._measure(cr, container_obj.action_draft, cr, uid, [container_id], context=context)
+
+    def run(self, cr, uid, operations=None, line_counts=None, product_count=None, picking_count=1, context=None):
+        """
+        Measures each operation on a new container, for each number of lines
+        Only the administrator can run the benchmarks
+        """
+        if uid != 1:
+            raise osv.except_osv(_('Error !'), _('Only the administrator can run the container benchmarks !'))
+        results = []
+        for operation in operations or OPERATIONS:
+            for line_count in line_counts or LINE_COUNTS:
+                cr.execute('SAVEPOINT container_benchmark')
+                try:
+                    container_id = self._create_container(cr, uid, line_count, product_count=product_count, picking_count=picking_count, context=context)
+                    result = getattr(self, '_bench_%s' % operation)(cr, uid, container_id, context=context)
+                    result.update(operation=operation, line_count=line_count, product_count=product_count or line_count, picking_count=picking_count)
+                    results.append(result)
+                finally:
+                    cr.execute('ROLLBACK TO SAVEPOINT container_benchmark')
+        return results
+
+    def benchmark_action_draft(self, cr, uid, line_counts=None, context=None):
+        """
+        Measures the revert of booked containers to draft, for each number of lines
+        """
+        return self.run(cr, uid, operations=['action_draft'], line_counts=line_counts, context=context)
+
+stock_container_benchmark()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
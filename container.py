@@ -28,8 +28,15 @@ from osv import osv
 from osv import fields
 from datetime import datetime, timedelta
 from tools.translate import _
+from profiling import profiled
+from product import get_product_logistics
+import logging
 import netsvc
-import itertools
+
+# Number of containers whose dates are updated in each transaction of the scheduled job
+DATES_CHUNK_SIZE = 100
+# Configuration parameter holding the last container processed by the scheduled job
+DATES_PROGRESS_KEY = 'container.dates_cron_last_id'
 
 
 class stock_container(osv.osv):
@@ -41,19 +48,82 @@ class stock_container(osv.osv):
         Computes weight, volume and remaining volume values
         """
         res = {}
-        for container in self.browse(cr, uid, ids, context=context):
-            weight = volume = 0.
-            # Add values from each move
-            for move in container.incoming_move_list_ids:
-                weight += move.product_qty * move.product_id.weight_net
-                volume += move.product_qty * move.product_id.volume
-            res[container.id] = {
-                'weight': weight,
-                'volume': volume,
-                'remaining_volume': container.product_id.volume - volume,
-            }
+        # Aggregate the values of all moves in one query per chunk of containers
+        for index in range(0, len(ids), cr.IN_MAX):
+            sub_ids = tuple(ids[index:index + cr.IN_MAX])
+            cr.execute("""
+                SELECT container.id,
+                    COALESCE(SUM(move.product_qty * template.weight_net), 0),
+                    COALESCE(SUM(move.product_qty * template.volume), 0),
+                    COALESCE(container_template.volume, 0)
+                FROM stock_container container
+                    JOIN product_product container_product ON container_product.id = container.product_id
+                    JOIN product_template container_template ON container_template.id = container_product.product_tmpl_id
+                    LEFT JOIN stock_container_move_rel rel ON rel.container_id = container.id
+                    LEFT JOIN stock_move move ON move.id = rel.move_id
+                    LEFT JOIN product_product product ON product.id = move.product_id
+                    LEFT JOIN product_template template ON template.id = product.product_tmpl_id
+                WHERE container.id IN %s
+                GROUP BY container.id, container_template.volume""", (sub_ids,))
+            for container_id, weight, volume, container_volume in cr.fetchall():
+                res[container_id] = {
+                    'weight': float(weight),
+                    'volume': float(volume),
+                    'remaining_volume': float(container_volume) - float(volume),
+                }
+        return res
+
+    def _get_job_state(self, cr, uid, ids, field_name, arg, context=None):
+        """
+        Returns the status of the last transition job of the containers
+        """
+        res = dict([(container_id, False) for container_id in ids])
+        cr.execute("""
+            SELECT DISTINCT ON (container_id) container_id, state
+            FROM stock_container_job
+            WHERE container_id IN %s
+            ORDER BY container_id, id DESC""", (tuple(ids),))
+        res.update(dict(cr.fetchall()))
         return res
 
+    def _get_containers_from_moves(self, cr, uid, ids, context=None):
+        """
+        Returns the containers in which the moves are listed as incoming moves
+        """
+        cr.execute('SELECT DISTINCT container_id FROM stock_container_move_rel WHERE move_id IN %s', (tuple(ids),))
+        return [row[0] for row in cr.fetchall()]
+
+    def _get_containers_from_products(self, cr, uid, ids, context=None):
+        """
+        Returns the containers using the products, as container product or in incoming moves
+        Archived containers keep the values they had, their moves are not in the relation anymore
+        """
+        cr.execute("""
+            SELECT id FROM stock_container WHERE product_id IN %s AND active
+            UNION
+            SELECT rel.container_id
+            FROM stock_container_move_rel rel
+                JOIN stock_move move ON move.id = rel.move_id
+            WHERE move.product_id IN %s""", (tuple(ids), tuple(ids)))
+        return [row[0] for row in cr.fetchall()]
+
+    def _get_containers_from_templates(self, cr, uid, ids, context=None):
+        """
+        Returns the containers using the variants of the product templates
+        """
+        cr.execute('SELECT id FROM product_product WHERE product_tmpl_id IN %s', (tuple(ids),))
+        product_ids = [row[0] for row in cr.fetchall()]
+        if not product_ids:
+            return []
+        return self.pool.get('stock.container')._get_containers_from_products(cr, uid, product_ids, context=context)
+
+    _values_store_triggers = {
+        'stock.container': (lambda self, cr, uid, ids, context=None: ids, ['incoming_move_list_ids', 'product_id'], 10),
+        'stock.move': (_get_containers_from_moves, ['product_qty', 'product_id'], 10),
+        'product.product': (_get_containers_from_products, ['weight_net', 'volume'], 10),
+        'product.template': (_get_containers_from_templates, ['weight_net', 'volume'], 10),
+    }
+
     _columns = {
         'name': fields.char('Name', size=64, required=True, help='Name of the container'),
         'partner_id': fields.many2one(
@@ -84,9 +154,9 @@ class stock_container(osv.osv):
             'RDV', readonly=True,
             states={'approaching': [('required', True), ('readonly', False)]},
             help='Date and time at which the transporter will show up at final destination to deliver the container'),
-        'weight': fields.function(_compute_values, method=True, string='Weight', type='float', store=False, multi='values', help='The total weight of all products listed in incoming move lists of the container'),
-        'volume': fields.function(_compute_values, method=True, string='Volume', type='float', store=False, multi='values', help='The total GROSS volume of all products listed in incoming move lists of the container'),
-        'remaining_volume': fields.function(_compute_values, method=True, string='Remaining Volume', type='float', store=False, multi='values', help='The substraction of the container product gross volume minus the total GROSS volume of all products listed in incoming move lists of the container'),
+        'weight': fields.function(_compute_values, method=True, string='Weight', type='float', store=_values_store_triggers, multi='values', help='The total weight of all products listed in incoming move lists of the container'),
+        'volume': fields.function(_compute_values, method=True, string='Volume', type='float', store=_values_store_triggers, multi='values', help='The total GROSS volume of all products listed in incoming move lists of the container'),
+        'remaining_volume': fields.function(_compute_values, method=True, string='Remaining Volume', type='float', store=_values_store_triggers, multi='values', help='The substraction of the container product gross volume minus the total GROSS volume of all products listed in incoming move lists of the container'),
         'product_id': fields.many2one(
             'product.product', 'Product', required=True,
             states={'draft': [('readonly', False)]},
@@ -102,7 +172,7 @@ class stock_container(osv.osv):
             help='Warehouse destination of the container\'s contents'),
         'incoming_move_list_ids': fields.many2many(
             'stock.move', 'stock_container_move_rel', 'container_id', 'move_id', 'Incoming Shipments',
-            domain="[('picking_id.type', '=', 'in'), ('state', '=', 'assigned'), '|', ('location_id.categ_id.id', '=', container_stock_location_id), ('location_id.categ_id', '=', False)]",
+            domain="[('container_candidate', '=', container_stock_location_id)]",
             readonly=True,
             states={'draft': [('readonly', False)]},
         ),
@@ -124,70 +194,187 @@ class stock_container(osv.osv):
   - Unpacking : The container is being unpacked at its final destination
   - Delivered : the container is archived with all fields locked"""),
         'prod_serial': fields.related('product_id', 'code', type='char', string='Product serial no.', help='Serial number of the product'),
+        'job_ids': fields.one2many('stock.container.job', 'container_id', 'Transition Jobs', readonly=True, help='Workflow transitions run in background'),
+        'job_state': fields.function(_get_job_state, method=True, string='Transition Status', type='selection', selection=[
+            ('pending', 'Pending'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ], help='Status of the last workflow transition run in background'),
+        'active': fields.boolean('Active', select=True, help='Archived containers are inactive, and their incoming shipments are moved to the archived shipments'),
+        'archived_move_list_ids': fields.many2many('stock.move', 'stock_container_move_rel_archive', 'container_id', 'move_id', 'Archived Incoming Shipments', readonly=True),
     }
 
     _defaults = {
         'state': 'draft',
+        'active': True,
     }
 
+    def _auto_init(self, cr, context=None):
+        """
+        Create the index used to find the containers of a move
+        """
+        res = super(stock_container, self)._auto_init(cr, context=context)
+        cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', ('stock_container_move_rel_move_id_index',))
+        if not cr.fetchone():
+            cr.execute('CREATE INDEX stock_container_move_rel_move_id_index ON stock_container_move_rel (move_id)')
+        # Only active containers are searched in the daily work
+        cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', ('stock_container_active_state_eta_index',))
+        if not cr.fetchone():
+            cr.execute('CREATE INDEX stock_container_active_state_eta_index ON stock_container (state, eta_date) WHERE active')
+        return res
+
     def get_dates_from_moves(self, cr, uid, container_id, context=None):
         """
         Modify container's dates from moves dates
         """
-        container = self.browse(cr, uid, container_id, context=context)
-        # Get the highest date of the moves
-        moves_list = [datetime.strptime(move.date, '%Y-%m-%d %H:%M:%S') for move in container.move_line_ids]
-        if not moves_list:
-            return {}
-        # Compute dates values
-        date_etm = max(moves_list)
-        eta_date = date_etm - timedelta(container.product_id.produce_delay or 0)
-        etd_date = date_etm - timedelta(container.product_id.sale_delay or 0)
-        # Set container's default dates
-        values = {
-            'etd_date': etd_date.strftime('%Y-%m-%d'),
-            'eta_date': eta_date.strftime('%Y-%m-%d'),
-            'etm_date': date_etm.strftime('%Y-%m-%d'),
-            'rdv_date': date_etm.strftime('%Y-%m-%d'),
-        }
-        return values
+        return self.get_dates_from_moves_batch(cr, uid, [container_id], context=context)[container_id]
+
+    @profiled()
+    def get_dates_from_moves_batch(self, cr, uid, ids, context=None):
+        """
+        Computes containers' dates from moves dates, for many containers at once
+        Returns a dict of dates values by container id, empty for containers without moves
+        """
+        res = dict([(container_id, {}) for container_id in ids])
+        for index in range(0, len(ids), cr.IN_MAX):
+            # Get the highest date of the moves
+            cr.execute("""
+                SELECT container.id, MAX(move.date), container.product_id
+                FROM stock_container container
+                    JOIN stock_move move ON move.container_id = container.id
+                WHERE container.id IN %s
+                GROUP BY container.id, container.product_id""", (tuple(ids[index:index + cr.IN_MAX]),))
+            rows = cr.fetchall()
+            products = get_product_logistics(cr, [product_id for container_id, date_max, product_id in rows])
+            for container_id, date_max, product_id in rows:
+                # Compute dates values
+                date_etm = datetime.strptime(date_max[:19], '%Y-%m-%d %H:%M:%S')
+                eta_date = date_etm - timedelta(products[product_id]['produce_delay'])
+                etd_date = date_etm - timedelta(products[product_id]['sale_delay'])
+                # Set container's default dates
+                res[container_id] = {
+                    'etd_date': etd_date.strftime('%Y-%m-%d'),
+                    'eta_date': eta_date.strftime('%Y-%m-%d'),
+                    'etm_date': date_etm.strftime('%Y-%m-%d'),
+                    'rdv_date': date_etm.strftime('%Y-%m-%d'),
+                }
+        return res
 
+    @profiled()
     def write(self, cr, uid, ids, values, context=None):
         """
         Write method
         """
+        if context is None:
+            context = {}
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        # The caller knows that dates don't need to be computed again
+        if context.get('container_no_dates'):
+            return super(stock_container, self).write(cr, uid, ids, values, context=context)
         res_users_obj = self.pool.get('res.users')
         company = res_users_obj.browse(cr, uid, uid, context=context).company_id
-        for container in self.browse(cr, uid, ids, context=context):
+        date_fields = ['etd_date', 'eta_date', 'etm_date', 'rdv_date']
+        # Only containers whose dates may change go through the dates computation
+        plain_ids = []
+        dated_containers = []
+        for container in self.read(cr, uid, ids, date_fields + ['state'], context=context):
+            new_state = values.get('state', container['state'])
+            # Dates are cascaded to moves for the first time when leaving booking
+            container['cascade_start'] = container['state'] in ('draft', 'booking') and new_state not in ('draft', 'booking')
+            if 'move_line_ids' in values or container['cascade_start'] \
+               or [field for field in date_fields if field in values and values[field] != container[field]] \
+               or ('state' in values and [field for field in date_fields if not container[field]]):
+                dated_containers.append(container)
+            else:
+                plain_ids.append(container['id'])
+        if plain_ids:
+            super(stock_container, self).write(cr, uid, plain_ids, values, context=context)
+        # Group the containers which will receive the same values
+        values_by_key = {}
+        ids_by_key = {}
+        cascade_ids = []
+        containers_dates = self.get_dates_from_moves_batch(cr, uid, [container['id'] for container in dated_containers], context=context)
+        for container in dated_containers:
             # Write new dates on container
-            new_dates = self.get_dates_from_moves(cr, uid, container.id, context=context)
-            etd_date = values.get('etd_date', False) or container.etd_date or new_dates.get('etd_date', False)
-            if etd_date:
-                values['etd_date'] = etd_date,
-            eta_date = values.get('eta_date', False) or container.eta_date or new_dates.get('eta_date', False)
-            if eta_date:
-                values['eta_date'] = eta_date,
-            etm_date = values.get('etm_date', False) or container.etm_date or new_dates.get('etm_date', False)
-            if etm_date:
-                values['etm_date'] = etm_date,
-            rdv_date = values.get('rdv_date', False) or container.rdv_date or new_dates.get('rdv_date', False)
-            if rdv_date:
-                values['rdv_date'] = rdv_date,
-            res = super(stock_container, self).write(cr, uid, [container.id], values, context=context)
-            if company.container_updates_dates:
-                # Adjusts dates on moves
-                if values.get('state', container.state) not in ('draft', 'booking'):
-                    stock_move_obj = self.pool.get('stock.move')
-                    stock_picking_obj = self.pool.get('stock.picking')
-                    move_ids = [move.id for move in container.move_line_ids]
-                    stock_move_obj.write(cr, uid, move_ids, {'date': values.get('etm_date', container.etm_date)}, context=context)
-                    # Search pickings to update their planned date
-                    stock_move_data = stock_move_obj.read(cr, uid, move_ids, ['picking_id'], context=context)
-                    picking_ids = [data['picking_id'][0] for data in stock_move_data if data.get('picking_id', False)]
-                    for picking in stock_picking_obj.browse(cr, uid, picking_ids, context=context):
-                        new_date = max([datetime.strptime(move.date, '%Y-%m-%d %H:%M:%S') for move in picking.move_lines])
-                        picking.write({'min_date': new_date.strftime('%Y-%m-%d')}, context=context)
-        return res
+            new_dates = containers_dates[container['id']]
+            container_values = dict(values)
+            for field in date_fields:
+                date = values.get(field, False) or container[field] or new_dates.get(field, False)
+                if date:
+                    container_values[field] = date
+            key = tuple(sorted([(field, container_values[field]) for field in date_fields if field in container_values]))
+            values_by_key[key] = container_values
+            ids_by_key.setdefault(key, []).append(container['id'])
+            # Moves only need new dates when the container's ETM changes
+            if values.get('state', container['state']) not in ('draft', 'booking') and \
+               ('move_line_ids' in values or container['cascade_start'] or container_values.get('etm_date', False) != container['etm_date']):
+                cascade_ids.append((container['id'], container_values.get('etm_date', False)))
+        for key, container_ids in ids_by_key.items():
+            super(stock_container, self).write(cr, uid, container_ids, values_by_key[key], context=context)
+        # The scheduled job applies the new dates when the company defers them
+        if company.container_updates_dates and cascade_ids and not company.container_deferred_dates:
+            self._cascade_dates(cr, uid, dict(cascade_ids), context=context)
+        return True
+
+    def _cascade_dates(self, cr, uid, cascade_dates, context=None):
+        """
+        Sets the date of the moves of the containers, then the planned date of their pickings
+        cascade_dates is a dict of ETM dates by container id
+        """
+        stock_move_obj = self.pool.get('stock.move')
+        # Adjusts dates on moves, grouped by date
+        move_ids_by_date = {}
+        move_ids = stock_move_obj.search(cr, uid, [('container_id', 'in', cascade_dates.keys())], context=context)
+        for move in stock_move_obj.read(cr, uid, move_ids, ['container_id'], context=context):
+            move_ids_by_date.setdefault(cascade_dates[move['container_id'][0]], []).append(move['id'])
+        for date, date_move_ids in move_ids_by_date.items():
+            stock_move_obj.write(cr, uid, date_move_ids, {'date': date}, context=context)
+        # Search pickings to update their planned date
+        stock_move_data = stock_move_obj.read(cr, uid, move_ids, ['picking_id'], context=context)
+        picking_ids = list(set([data['picking_id'][0] for data in stock_move_data if data.get('picking_id', False)]))
+        self.pool.get('stock.picking').update_min_date_from_moves(cr, uid, picking_ids, context=context)
+        return True
+
+    def _cascade_dates_cron(self, cr, uid, chunk_size=DATES_CHUNK_SIZE, context=None):
+        """
+        Applies the ETM date of the containers on their moves and pickings when they differ,
+        chunk by chunk, with a commit after each chunk
+        The last processed container is saved, so a stopped run goes on where it stopped
+        """
+        company = self.pool.get('res.users').browse(cr, uid, uid, context=context).company_id
+        if not company.container_updates_dates:
+            return True
+        config_parameter_obj = self.pool.get('ir.config_parameter')
+        logger = logging.getLogger('container')
+        last_id = int(config_parameter_obj.get_param(cr, uid, DATES_PROGRESS_KEY, '0'))
+        while True:
+            cr.execute("""
+                SELECT container.id, container.etm_date
+                FROM stock_container container
+                WHERE container.active
+                    AND container.state NOT IN ('draft', 'booking', 'delivered', 'cancel')
+                    AND container.etm_date IS NOT NULL
+                    AND container.id > %s
+                    AND EXISTS (SELECT 1 FROM stock_move move WHERE move.container_id = container.id AND move.date <> container.etm_date)
+                ORDER BY container.id
+                LIMIT %s""", (last_id, chunk_size))
+            cascade_ids = cr.fetchall()
+            if not cascade_ids:
+                break
+            try:
+                self._cascade_dates(cr, uid, dict(cascade_ids), context=context)
+            except Exception:
+                cr.rollback()
+                logger.exception('Unable to update the dates of containers %s', ', '.join([str(container_id) for container_id, etm_date in cascade_ids]))
+            last_id = cascade_ids[-1][0]
+            config_parameter_obj.set_param(cr, uid, DATES_PROGRESS_KEY, str(last_id))
+            cr.commit()
+        # Next run starts again from the first container
+        config_parameter_obj.set_param(cr, uid, DATES_PROGRESS_KEY, '0')
+        cr.commit()
+        return True
 
     def unlink(self, cr, uid, ids, context=None):
         """
@@ -197,18 +384,208 @@ class stock_container(osv.osv):
             raise osv.except_osv(_('Error'), _('A container must be in state draft to be deleted !'))
         return super(stock_container, self).unlink(cr, uid, ids, context=context)
 
+    def action_archive(self, cr, uid, ids, context=None):
+        """
+        Deactivates delivered and cancelled containers, and moves their incoming shipments in the archive table
+        Containers already archived are left as they are
+        """
+        if not ids:
+            return True
+        cr.execute("SELECT id FROM stock_container WHERE id IN %s AND state NOT IN ('delivered', 'cancel')", (tuple(ids),))
+        if cr.fetchone():
+            raise osv.except_osv(_('Error'), _('Only delivered or cancelled containers can be archived !'))
+        cr.execute('SELECT id FROM stock_container WHERE id IN %s AND active', (tuple(ids),))
+        ids = [row[0] for row in cr.fetchall()]
+        if not ids:
+            return True
+        cr.execute('INSERT INTO stock_container_move_rel_archive (container_id, move_id) SELECT container_id, move_id FROM stock_container_move_rel WHERE container_id IN %s', (tuple(ids),))
+        cr.execute('DELETE FROM stock_container_move_rel WHERE container_id IN %s', (tuple(ids),))
+        cr.execute('DELETE FROM stock_container_availability WHERE container_id IN %s', (tuple(ids),))
+        return self.write(cr, uid, ids, {'active': False}, context=dict(context or {}, container_no_dates=True))
+
+    def action_restore(self, cr, uid, ids, context=None):
+        """
+        Activates archived containers again, with their incoming shipments
+        Containers which are not archived are left as they are
+        """
+        if not ids:
+            return True
+        cr.execute('SELECT id FROM stock_container WHERE id IN %s AND NOT active', (tuple(ids),))
+        ids = [row[0] for row in cr.fetchall()]
+        if not ids:
+            return True
+        cr.execute('INSERT INTO stock_container_move_rel (container_id, move_id) SELECT container_id, move_id FROM stock_container_move_rel_archive WHERE container_id IN %s', (tuple(ids),))
+        cr.execute('DELETE FROM stock_container_move_rel_archive WHERE container_id IN %s', (tuple(ids),))
+        # Products may have changed while the containers were archived
+        self._store_set_values(cr, uid, ids, ['weight', 'volume', 'remaining_volume'], context)
+        self.pool.get('stock.container.availability').refresh(cr, uid, ids, context=context)
+        return self.write(cr, uid, ids, {'active': True}, context=dict(context or {}, container_no_dates=True))
+
+    def _archive_cron(self, cr, uid, context=None):
+        """
+        Archives the delivered and cancelled containers unchanged since the number of days set on the company
+        """
+        company = self.pool.get('res.users').browse(cr, uid, uid, context=context).company_id
+        if not company.container_archive_days:
+            return True
+        cr.execute("""
+            SELECT id FROM stock_container
+            WHERE active AND state IN ('delivered', 'cancel') AND write_date < (now() at time zone 'UTC') - %s * interval '1 day'""", (company.container_archive_days,))
+        container_ids = [row[0] for row in cr.fetchall()]
+        for index in range(0, len(container_ids), cr.IN_MAX):
+            self.action_archive(cr, uid, container_ids[index:index + cr.IN_MAX], context=context)
+        return True
+
+    def _prefetch(self, cr, uid, ids, context=None):
+        """
+        Loads the containers with their moves, pickings, locations and products in a constant number of queries
+        Returns a dict of dicts of values by id, for each of these objects
+        """
+        data = {'containers': {}, 'moves': {}, 'pickings': {}, 'locations': {}, 'products': {}}
+        if not ids:
+            return data
+        cr.execute('SELECT id, state, product_id, container_stock_location_id FROM stock_container WHERE id IN %s', (tuple(ids),))
+        for container_id, state, product_id, location_id in cr.fetchall():
+            data['containers'][container_id] = {
+                'state': state,
+                'product_id': product_id,
+                'container_stock_location_id': location_id,
+                'incoming_move_ids': [],
+                'move_ids': [],
+            }
+        cr.execute('SELECT container_id, move_id FROM stock_container_move_rel WHERE container_id IN %s ORDER BY move_id', (tuple(ids),))
+        for container_id, move_id in cr.fetchall():
+            data['containers'][container_id]['incoming_move_ids'].append(move_id)
+        incoming_move_ids = [move_id for container in data['containers'].values() for move_id in container['incoming_move_ids']]
+        cr.execute("""
+            SELECT id, container_id, location_id, location_dest_id, move_dest_id, picking_id, product_id, product_qty, date, state
+            FROM stock_move
+            WHERE container_id IN %s OR id IN %s
+            ORDER BY id""", (tuple(ids), tuple(incoming_move_ids or [0])))
+        for move_id, container_id, location_id, location_dest_id, move_dest_id, picking_id, product_id, product_qty, date, state in cr.fetchall():
+            data['moves'][move_id] = {
+                'container_id': container_id,
+                'location_id': location_id,
+                'location_dest_id': location_dest_id,
+                'move_dest_id': move_dest_id,
+                'picking_id': picking_id,
+                'product_id': product_id,
+                'product_qty': product_qty,
+                'date': date,
+                'state': state,
+            }
+            if container_id in data['containers']:
+                data['containers'][container_id]['move_ids'].append(move_id)
+        picking_ids = list(set([move['picking_id'] for move in data['moves'].values() if move['picking_id']]))
+        if picking_ids:
+            cr.execute('SELECT id, state FROM stock_picking WHERE id IN %s', (tuple(picking_ids),))
+            for picking_id, state in cr.fetchall():
+                data['pickings'][picking_id] = {'state': state}
+        location_ids = list(set([container['container_stock_location_id'] for container in data['containers'].values()] + [move['location_id'] for move in data['moves'].values()]))
+        cr.execute('SELECT id, usage, categ_id FROM stock_location WHERE id IN %s', (tuple(location_ids),))
+        for location_id, usage, categ_id in cr.fetchall():
+            data['locations'][location_id] = {'usage': usage, 'categ_id': categ_id}
+        product_ids = list(set([container['product_id'] for container in data['containers'].values()] + [move['product_id'] for move in data['moves'].values()]))
+        data['products'] = get_product_logistics(cr, product_ids)
+        return data
+
+    def _get_busy_ids(self, cr, uid, ids, context=None):
+        """
+        Returns the containers which have a transition waiting or running in background
+        """
+        if not ids:
+            return []
+        cr.execute("SELECT DISTINCT container_id FROM stock_container_job WHERE container_id IN %s AND state IN ('pending', 'running')", (tuple(ids),))
+        return [row[0] for row in cr.fetchall()]
+
+    def _lock_for_transition(self, cr, uid, ids, context=None):
+        """
+        Refuses a direct transition on containers which have a background transition,
+        then locks them against the background jobs until the end of the transaction
+        """
+        busy_ids = self._get_busy_ids(cr, uid, ids, context=context)
+        if busy_ids:
+            names = ', '.join([name for container_id, name in self.name_get(cr, uid, busy_ids, context=context)])
+            raise osv.except_osv(_('Warning !'), _('A background transition is waiting for the containers %s, try again once it is done !') % names)
+        try:
+            cr.execute('SELECT id FROM stock_container WHERE id IN %s FOR UPDATE NOWAIT', (tuple(ids),))
+        except Exception:
+            raise osv.except_osv(_('Warning !'), _('The containers are being changed by another user or a background job, try again later !'))
+        return True
+
+    def send_signal(self, cr, uid, ids, signal, context=None):
+        """
+        Sends a workflow signal to the containers, in background jobs if enabled on the company
+        """
+        if context is None:
+            context = {}
+        company = self.pool.get('res.users').browse(cr, uid, uid, context=context).company_id
+        if context.get('container_async', company.container_async_transitions):
+            self.pool.get('stock.container.job').enqueue(cr, uid, ids, signal, context=context)
+            return True
+        self._lock_for_transition(cr, uid, ids, context=context)
+        wf_service = netsvc.LocalService("workflow")
+        for container_id in ids:
+            wf_service.trg_validate(uid, 'stock.container', container_id, signal, cr)
+        return True
+
+    def transition_batch(self, cr, uid, ids, signals, context=None):
+        """
+        Sends a list of workflow signals to each container, in order
+        A failing container is restored as it was before its first signal, without stopping the others
+        Returns a list of (container_id, error message) for the failing containers
+        """
+        wf_service = netsvc.LocalService("workflow")
+        errors = []
+        busy_ids = self._get_busy_ids(cr, uid, ids, context=context)
+        for container in self.read(cr, uid, ids, ['name', 'state'], context=context):
+            if container['id'] in busy_ids:
+                errors.append((container['id'], _('A background transition is waiting for this container !')))
+                continue
+            cr.execute('SAVEPOINT container_transition')
+            try:
+                cr.execute('SELECT id FROM stock_container WHERE id = %s FOR UPDATE NOWAIT', (container['id'],))
+                for signal in signals:
+                    wf_service.trg_validate(uid, 'stock.container', container['id'], signal, cr)
+                cr.execute('SELECT state FROM stock_container WHERE id = %s', (container['id'],))
+                if cr.fetchone()[0] == container['state']:
+                    raise osv.except_osv(_('Warning !'), _('The container %s cannot leave the state %s !') % (container['name'], container['state']))
+                cr.execute('RELEASE SAVEPOINT container_transition')
+            except Exception as e:
+                cr.execute('ROLLBACK TO SAVEPOINT container_transition')
+                errors.append((container['id'], isinstance(e, osv.except_osv) and e.value or unicode(e)))
+        return errors
+
+    def action_transition(self, cr, uid, ids, context=None):
+        """
+        Button sending the workflow signal given in context
+        """
+        if context is None:
+            context = {}
+        return self.send_signal(cr, uid, ids, context['container_signal'], context=context)
+
+    @profiled()
     def action_draft(self, cr, uid, ids, context=None):
         """
         Action launched when the user want to revert in draft
         """
-        container_moves = list(itertools.chain.from_iterable([container.move_line_ids for container in self.browse(cr, uid, ids, context=context)]))
-        for move in container_moves:
-            # Restore the source location on incoming moves
-            move.move_dest_id.write({'location_id': move.location_id.id}, context=context)
+        stock_move_obj = self.pool.get('stock.move')
+        data = self._prefetch(cr, uid, ids, context=context)
+        container_move_ids = [move_id for container in data['containers'].values() for move_id in container['move_ids']]
+        # Restore the source location on incoming moves, with one write per location
+        dest_ids_by_location = {}
+        for move_id in container_move_ids:
+            move = data['moves'][move_id]
+            if move['move_dest_id']:
+                dest_ids_by_location.setdefault(move['location_id'], []).append(move['move_dest_id'])
+        for location_id, dest_ids in dest_ids_by_location.items():
+            stock_move_obj.write(cr, uid, dest_ids, {'location_id': location_id}, context=context)
         # Delete the container moves
-        self.pool.get('stock.move').unlink(cr, uid, [move.id for move in container_moves], context=context)
+        stock_move_obj.unlink(cr, uid, container_move_ids, context=dict(context or {}, container_no_availability=True))
+        self.pool.get('stock.container.availability').refresh(cr, uid, ids, context=context)
         return True
 
+    @profiled()
     def action_booking(self, cr, uid, ids, context=None):
         """
         Action launched when arriving on booking state
@@ -217,36 +594,41 @@ class stock_container(osv.osv):
             # There is no context in workflow, so get it on user
             context = self.pool.get('res.users').context_get(cr, uid, context=context)
         stock_move_obj = self.pool.get('stock.move')
-        for container in self.browse(cr, uid, ids, context=context):
+        data = self._prefetch(cr, uid, ids, context=context)
+        remaining_volumes = dict([(container['id'], container['remaining_volume']) for container in self.read(cr, uid, ids, ['remaining_volume'], context=context)])
+        copies = []
+        for container_id in ids:
+            container = data['containers'][container_id]
             # Check container's location
             #if container.incoterm_id.code in ['EXW', 'FCA', 'FAS', 'FOB', 'CFR', 'CIF', 'CPT', 'CIP'] and container.container_stock_location_id.usage != 'internal':
             #    raise osv.except_osv(_('Warning !'), _('You must define container stock location as company location !'))
             #elif container.incoterm_id.code in ['DAF', 'DES', 'DES', 'DDU', 'DDP'] and container.container_stock_location_id.usage != 'supplier':
             #    raise osv.except_osv(_('Warning !'), _('You must define container stock location as supplier location !'))
             #FIXME : In version 6, we must have the stock location in internal else impossible to create invoice supplier
-            if container.container_stock_location_id.usage != 'supplier':
+            if data['locations'][container['container_stock_location_id']]['usage'] != 'supplier':
                 raise osv.except_osv(_('Warning !'), _('You must define container stock location as supplier location !'))
             # Check remaining volume
-            if container.remaining_volume < 0:
+            if remaining_volumes[container_id] < 0:
                 raise osv.except_osv(_('Warning !'), _('Remaining volume must be positive !'))
             # Chek if the user filled picking in in this container before booking
-            if not container.incoming_move_list_ids:
+            if not container['incoming_move_ids']:
                 raise osv.except_osv(_('Warning !'), _('You must select incoming shipments before booking !'))
             # Create outgoing moves from incoming moves
-            default = {
-                'state': 'draft',
-                'picking_id': False,
-                'container_id': container.id,
-                'location_dest_id': container.container_stock_location_id.id,
-            }
-            for move in container.incoming_move_list_ids:
-                default['move_dest_id'] = move.id
-                # Create the new move
-                stock_move_obj.copy(cr, uid, move.id, default, context=context)
-            # Read incoming move list
-            move_ids = [move.id for move in container.incoming_move_list_ids]
+            for move_id in container['incoming_move_ids']:
+                copies.append((move_id, {
+                    'state': 'draft',
+                    'picking_id': False,
+                    'container_id': container_id,
+                    'location_dest_id': container['container_stock_location_id'],
+                    'move_dest_id': move_id,
+                }))
+        # Create all the new moves at once
+        stock_move_obj._copy_bulk(cr, uid, copies, context=dict(context, container_no_availability=True))
+        self.pool.get('stock.container.availability').refresh(cr, uid, ids, context=context)
+        for container_id in ids:
+            container = data['containers'][container_id]
             # Changes incoming moves' location to container's location
-            stock_move_obj.write(cr, uid, move_ids, {'location_id': container.container_stock_location_id.id}, context=context)
+            stock_move_obj.write(cr, uid, container['incoming_move_ids'], {'location_id': container['container_stock_location_id']}, context=context)
         return True
 
     def action_freight(self, cr, uid, ids, context=None):
@@ -290,10 +672,13 @@ class stock_container(osv.osv):
         if context is None:
             # There is no context in workflow, so get it on user
             context = self.pool.get('res.users').context_get(cr, uid, context=context)
-        for container in self.browse(cr, uid, ids, context=context):
+        data = self._prefetch(cr, uid, ids, context=context)
+        for container in data['containers'].values():
             # Error if one of the incoming pickings is in cancel state
-            if [move.picking_id.id for move in container.incoming_move_list_ids if move.picking_id.state != 'cancel']:
-                raise osv.except_osv(_('Warning !'), _('Incoming or outgoing packing list not in cancel state !'))
+            for move_id in container['incoming_move_ids']:
+                picking_id = data['moves'][move_id]['picking_id']
+                if not picking_id or data['pickings'][picking_id]['state'] != 'cancel':
+                    raise osv.except_osv(_('Warning !'), _('Incoming or outgoing packing list not in cancel state !'))
         return True
 
     def action_deliver(self, cr, uid, ids, context=None):
@@ -302,10 +687,15 @@ class stock_container(osv.osv):
         """
         if context is None:
             context = {}
-        wf_service = netsvc.LocalService("workflow")
-        for container in self.browse(cr, uid, ids, context=context):
-            picking_ids = [move.picking_id.id for move in container.incoming_move_list_ids]
-            wf_service.trg_validate(uid, 'stock.container', container.id, 'button_deliver', cr)
+        data = self._prefetch(cr, uid, ids, context=context)
+        picking_ids = []
+        for container_id in ids:
+            for move_id in data['containers'][container_id]['incoming_move_ids']:
+                picking_id = data['moves'][move_id]['picking_id']
+                if picking_id and picking_id not in picking_ids:
+                    picking_ids.append(picking_id)
+        # The pickings are processed by the user right after, the transition cannot wait for a background job
+        self.send_signal(cr, uid, ids, 'button_deliver', context=dict(context, container_async=False))
 
         partial_id = self.pool.get("stock.partial.picking").create(cr, uid, {}, context=dict(context, active_ids=picking_ids, active_model='stock.picking', container_ids=ids))
         return {
@@ -322,6 +712,94 @@ class stock_container(osv.osv):
             'context': dict(context, active_ids=picking_ids, container_ids=ids)
         }
 
+    def plan_load(self, cr, uid, ids, move_ids=None, context=None):
+        """
+        Distributes incoming moves in the draft containers, by decreasing volume (first fit decreasing)
+        A container receives moves while they fit in its remaining volume and maximum load
+        When no move is given, all assigned incoming moves which are not in a container are used
+        Returns the ids of the moves which didn't fit in any container, or cannot be loaded
+        (not an assigned incoming move, or already in a container)
+        """
+        if move_ids is None:
+            move_ids = self.pool.get('stock.container.candidate').get_candidates(cr, uid, free=True, limit=None, context=context)
+        if not ids or not move_ids:
+            return move_ids
+        containers = []
+        container_data = self.read(cr, uid, ids, ['state', 'remaining_volume', 'weight', 'product_id', 'container_stock_location_id'], context=context)
+        container_products = get_product_logistics(cr, [container['product_id'][0] for container in container_data])
+        for container in container_data:
+            if container['state'] != 'draft':
+                raise osv.except_osv(_('Warning !'), _('Moves can only be planned in draft containers !'))
+            max_weight = container_products[container['product_id'][0]]['container_max_weight']
+            # No maximum load means no weight limit
+            remaining_weight = None
+            if max_weight:
+                remaining_weight = max_weight - container['weight']
+            containers.append({
+                'id': container['id'],
+                'remaining_volume': container['remaining_volume'],
+                'remaining_weight': remaining_weight,
+                'location_id': container['container_stock_location_id'] and container['container_stock_location_id'][0],
+                'move_ids': [],
+            })
+        # Read the volume and weight of all moves at once, only free candidates can be loaded
+        candidate_query, candidate_params = self.pool.get('stock.container.candidate').get_candidates_query(free=True)
+        moves = []
+        loadable_move_ids = set()
+        for index in range(0, len(move_ids), cr.IN_MAX):
+            cr.execute("""
+                SELECT move.id, move.product_id, move.product_qty, location.categ_id
+                FROM stock_move move
+                    JOIN stock_location location ON location.id = move.location_id
+                WHERE move.id IN %s AND move.id IN (""" + candidate_query + ')', [tuple(move_ids[index:index + cr.IN_MAX])] + candidate_params)
+            rows = cr.fetchall()
+            loadable_move_ids.update([row[0] for row in rows])
+            products = get_product_logistics(cr, [product_id for move_id, product_id, product_qty, categ_id in rows])
+            moves.extend([(move_id, float(product_qty) * products[product_id]['volume'], float(product_qty) * products[product_id]['weight_net'], categ_id)
+                          for move_id, product_id, product_qty, categ_id in rows])
+        moves.sort(key=lambda move: (move[1], move[2]), reverse=True)
+        unplanned_move_ids = [move_id for move_id in move_ids if move_id not in loadable_move_ids]
+        for move_id, volume, weight, categ_id in moves:
+            for container in containers:
+                # Same location restriction as the incoming move list domain
+                if categ_id and categ_id != container['location_id']:
+                    continue
+                if volume <= container['remaining_volume'] and (container['remaining_weight'] is None or weight <= container['remaining_weight']):
+                    container['remaining_volume'] -= volume
+                    if container['remaining_weight'] is not None:
+                        container['remaining_weight'] -= weight
+                    container['move_ids'].append(move_id)
+                    break
+            else:
+                unplanned_move_ids.append(move_id)
+        for container in containers:
+            if container['move_ids']:
+                self.write(cr, uid, [container['id']], {'incoming_move_list_ids': [(4, move_id) for move_id in container['move_ids']]}, context=context)
+        return unplanned_move_ids
+
+    def name_get(self, cr, uid, ids, context=None):
+        """
+        Adds the free quantity of the product given in context to the container name
+        """
+        if context is None:
+            context = {}
+        res = super(stock_container, self).name_get(cr, uid, ids, context=context)
+        if not context.get('container_product_id') or not res:
+            return res
+        free_qty = self.pool.get('stock.container.availability').get_free_qty(cr, uid, [(container_id, context['container_product_id']) for container_id, name in res], context=context)
+        return [(container_id, '%s (%s)' % (name, free_qty[(container_id, context['container_product_id'])])) for container_id, name in res]
+
+    def name_search(self, cr, uid, name='', args=None, operator='ilike', context=None, limit=100):
+        """
+        Only proposes containers with free quantity of the product given in context
+        """
+        if context is None:
+            context = {}
+        if context.get('container_product_id'):
+            cr.execute('SELECT container_id FROM stock_container_availability WHERE product_id = %s AND free_qty > 0', (context['container_product_id'],))
+            args = (args or []) + [('id', 'in', [row[0] for row in cr.fetchall()])]
+        return super(stock_container, self).name_search(cr, uid, name=name, args=args, operator=operator, context=context, limit=limit)
+
     def copy(self, cr, uid, id, default=None, context=None):
         """
         Removes some values to avoid creating duplicate pickings
@@ -329,6 +807,9 @@ class stock_container(osv.osv):
         default = {
             'incoming_move_list_ids': [],
             'move_line_ids': [],
+            'job_ids': [],
+            'archived_move_list_ids': [],
+            'active': True,
         }
         return super(stock_container, self).copy(cr, uid, id, default, context=context)
 
@@ -337,9 +818,10 @@ class stock_container(osv.osv):
         Change date of container
         """
         date_etd = datetime.strptime(new_date, '%Y-%m-%d')
-        for container in self.browse(cr, uid, ids, context=context):
-            etm_date = date_etd + timedelta(container.product_id.sale_delay or 0)
-            eta_date = etm_date - timedelta(container.product_id.produce_delay or 0)
+        for container in self.read(cr, uid, ids, ['product_id'], context=context):
+            product = get_product_logistics(cr, [container['product_id'][0]])[container['product_id'][0]]
+            etm_date = date_etd + timedelta(product['sale_delay'])
+            eta_date = etm_date - timedelta(product['produce_delay'])
         return {'value': {
             'eta_date': eta_date.strftime('%Y-%m-%d'),
             'etm_date': etm_date.strftime('%Y-%m-%d'),
@@ -351,10 +833,11 @@ class stock_container(osv.osv):
         Change date of container
         """
         date_eta = datetime.strptime(new_date, '%Y-%m-%d')
-        for container in self.browse(cr, uid, ids, context=context):
-            etm_date = date_eta + timedelta(container.product_id.produce_delay or 0)
-            if container.state in ('draft', 'booking'):
-                etd_date = etm_date - timedelta(container.product_id.sale_delay or 0)
+        for container in self.read(cr, uid, ids, ['product_id', 'state'], context=context):
+            product = get_product_logistics(cr, [container['product_id'][0]])[container['product_id'][0]]
+            etm_date = date_eta + timedelta(product['produce_delay'])
+            if container['state'] in ('draft', 'booking'):
+                etd_date = etm_date - timedelta(product['sale_delay'])
                 return {'value': {
                     'etd_date': etd_date.strftime('%Y-%m-%d'),
                     'etm_date': etm_date.strftime('%Y-%m-%d'),
@@ -370,17 +853,18 @@ class stock_container(osv.osv):
         Change date of container
         """
         date_etm = datetime.strptime(new_date, '%Y-%m-%d')
-        for container in self.browse(cr, uid, ids, context=context):
-            if container.state in ('draft', 'booking'):
-                eta_date = date_etm - timedelta(container.product_id.produce_delay or 0)
-                etd_date = date_etm - timedelta(container.product_id.sale_delay or 0)
+        for container in self.read(cr, uid, ids, ['product_id', 'state'], context=context):
+            product = get_product_logistics(cr, [container['product_id'][0]])[container['product_id'][0]]
+            if container['state'] in ('draft', 'booking'):
+                eta_date = date_etm - timedelta(product['produce_delay'])
+                etd_date = date_etm - timedelta(product['sale_delay'])
                 return {'value': {
                     'eta_date': eta_date.strftime('%Y-%m-%d'),
                     'etd_date': etd_date.strftime('%Y-%m-%d'),
                     'rdv_date': date_etm.strftime('%Y-%m-%d'),
                 }}
-            elif container.state == 'freight':
-                etd_date = date_etm - timedelta(container.product_id.sale_delay or 0)
+            elif container['state'] == 'freight':
+                etd_date = date_etm - timedelta(product['sale_delay'])
                 return {'value': {
                     'etd_date': etd_date.strftime('%Y-%m-%d'),
                     'rdv_date': date_etm.strftime('%Y-%m-%d'),
@@ -392,4 +876,179 @@ class stock_container(osv.osv):
 
 stock_container()
 
+
+class stock_container_availability(osv.osv):
+    _name = 'stock.container.availability'
+    _description = 'Container Availability'
+    _rec_name = 'product_id'
+
+    _columns = {
+        'container_id': fields.many2one('stock.container', 'Container', required=True, readonly=True, ondelete='cascade', select=True, help='Container holding the products'),
+        'product_id': fields.many2one('product.product', 'Product', required=True, readonly=True, ondelete='cascade', select=True, help='Product held in the container'),
+        'total_qty': fields.float('Total Quantity', readonly=True, help='Quantity of the product in the container moves'),
+        'reserved_qty': fields.float('Reserved Quantity', readonly=True, help='Quantity of the product reserved by sale order lines'),
+        'free_qty': fields.float('Free Quantity', readonly=True, help='Quantity of the product still available for sale order lines'),
+    }
+
+    _sql_constraints = [
+        ('container_product_uniq', 'unique (container_id, product_id)', 'A product can only be listed once per container !'),
+    ]
+
+    def init(self, cr):
+        """
+        Fill the table when updating the module
+        """
+        # On install, the container column of the moves is only added later, and no move is in a container yet
+        cr.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'stock_move' AND column_name = 'container_id'")
+        if not cr.fetchone():
+            return
+        cr.execute('SELECT DISTINCT container_id FROM stock_move WHERE container_id IS NOT NULL')
+        container_ids = [row[0] for row in cr.fetchall()]
+        if container_ids:
+            self.refresh(cr, 1, container_ids)
+
+    def refresh(self, cr, uid, container_ids, product_ids=None, context=None):
+        """
+        Recompute the quantities of the products in the containers from their moves
+        """
+        if not container_ids:
+            return True
+        where = 'container_id IN %s'
+        params = [tuple(container_ids)]
+        if product_ids:
+            where += ' AND product_id IN %s'
+            params.append(tuple(product_ids))
+        cr.execute('DELETE FROM stock_container_availability WHERE ' + where, params)
+        cr.execute("""
+            INSERT INTO stock_container_availability (create_uid, create_date, container_id, product_id, total_qty, reserved_qty, free_qty)
+            SELECT %s, (now() at time zone 'UTC'), container_id, product_id,
+                SUM(product_qty),
+                SUM(CASE WHEN sale_line_id IS NOT NULL THEN product_qty ELSE 0 END),
+                SUM(CASE WHEN sale_line_id IS NULL THEN product_qty ELSE 0 END)
+            FROM stock_move
+            WHERE picking_id IS NULL AND """ + where + """
+            GROUP BY container_id, product_id""", [uid] + params)
+        return True
+
+    def get_free_qty(self, cr, uid, keys, context=None):
+        """
+        Returns the free quantities for a list of (container_id, product_id) keys
+        """
+        res = dict([(key, 0.) for key in keys])
+        if not keys:
+            return res
+        cr.execute("""
+            SELECT container_id, product_id, free_qty
+            FROM stock_container_availability
+            WHERE (container_id, product_id) IN %s""", (tuple(set(keys)),))
+        for container_id, product_id, free_qty in cr.fetchall():
+            res[(container_id, product_id)] = free_qty
+        return res
+
+stock_container_availability()
+
+
+class stock_container_candidate(osv.osv):
+    _name = 'stock.container.candidate'
+    _description = 'Container Candidate Move'
+    _rec_name = 'move_id'
+    _order = 'move_id'
+
+    _columns = {
+        'move_id': fields.many2one('stock.move', 'Move', required=True, readonly=True, ondelete='cascade', help='Assigned incoming move which can be loaded in a container'),
+        'categ_id': fields.many2one('stock.location.category', 'Location Category', readonly=True, ondelete='set null', help='Category of the source location of the move'),
+        'partner_id': fields.many2one('res.partner', 'Supplier', readonly=True, ondelete='set null', help='Partner of the incoming shipment'),
+        'product_id': fields.many2one('product.product', 'Product', readonly=True, ondelete='cascade', help='Product of the move'),
+    }
+
+    _sql_constraints = [
+        ('move_uniq', 'unique (move_id)', 'A move can only be listed once as candidate !'),
+    ]
+
+    def _auto_init(self, cr, context=None):
+        """
+        Create the index used to page through the candidates of a location category
+        """
+        res = super(stock_container_candidate, self)._auto_init(cr, context=context)
+        cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', ('stock_container_candidate_categ_partner_product_index',))
+        if not cr.fetchone():
+            cr.execute('CREATE INDEX stock_container_candidate_categ_partner_product_index ON stock_container_candidate (categ_id, partner_id, product_id, move_id)')
+        return res
+
+    def init(self, cr):
+        """
+        Fill the table when installing or updating the module
+        """
+        cr.execute('DELETE FROM stock_container_candidate')
+        self._insert(cr, 1, 'TRUE', [])
+
+    def _insert(self, cr, uid, where, params):
+        """
+        Inserts the assigned incoming moves matching the condition
+        """
+        cr.execute("""
+            INSERT INTO stock_container_candidate (create_uid, create_date, move_id, categ_id, partner_id, product_id)
+            SELECT %s, (now() at time zone 'UTC'), move.id, location.categ_id, address.partner_id, move.product_id
+            FROM stock_move move
+                JOIN stock_picking picking ON picking.id = move.picking_id
+                JOIN stock_location location ON location.id = move.location_id
+                LEFT JOIN res_partner_address address ON address.id = picking.address_id
+            WHERE picking.type = 'in' AND move.state = 'assigned' AND """ + where, [uid] + params)
+
+    def refresh(self, cr, uid, move_ids, context=None):
+        """
+        Recompute the candidate rows of the moves
+        """
+        if not move_ids:
+            return True
+        for index in range(0, len(move_ids), cr.IN_MAX):
+            sub_ids = tuple(move_ids[index:index + cr.IN_MAX])
+            cr.execute('DELETE FROM stock_container_candidate WHERE move_id IN %s', (sub_ids,))
+            self._insert(cr, uid, 'move.id IN %s', [sub_ids])
+        return True
+
+    def _get_where(self, categ_id=None, partner_id=None, product_id=None, free=False):
+        """
+        Returns the condition and parameters selecting candidates
+        categ_id follows the incoming move list domain : moves without location category are always proposed
+        """
+        where = ['TRUE']
+        params = []
+        if categ_id is not None:
+            where.append('(candidate.categ_id = %s OR candidate.categ_id IS NULL)')
+            params.append(categ_id or None)
+        if partner_id:
+            where.append('candidate.partner_id = %s')
+            params.append(partner_id)
+        if product_id:
+            where.append('candidate.product_id = %s')
+            params.append(product_id)
+        if free:
+            where.append('NOT EXISTS (SELECT 1 FROM stock_container_move_rel rel WHERE rel.move_id = candidate.move_id)')
+        return ' AND '.join(where), params
+
+    def get_candidates(self, cr, uid, categ_id=None, partner_id=None, product_id=None, free=False, after_id=0, limit=80, context=None):
+        """
+        Returns a page of candidate move ids, ordered by id
+        The next page starts after the last returned id
+        categ_id, partner_id and product_id filter the candidates, free excludes the moves already in a container
+        """
+        where, params = self._get_where(categ_id=categ_id, partner_id=partner_id, product_id=product_id, free=free)
+        query = 'SELECT candidate.move_id FROM stock_container_candidate candidate WHERE candidate.move_id > %s AND ' + where + ' ORDER BY candidate.move_id'
+        params = [after_id] + params
+        if limit:
+            query += ' LIMIT %s'
+            params.append(limit)
+        cr.execute(query, params)
+        return [row[0] for row in cr.fetchall()]
+
+    def get_candidates_query(self, categ_id=None, partner_id=None, product_id=None, free=False):
+        """
+        Returns the query and parameters selecting the candidate move ids, to be used as subquery
+        """
+        where, params = self._get_where(categ_id=categ_id, partner_id=partner_id, product_id=product_id, free=free)
+        return 'SELECT candidate.move_id FROM stock_container_candidate candidate WHERE ' + where, params
+
+stock_container_candidate()
+
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
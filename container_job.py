@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from osv import osv
+from osv import fields
+from datetime import datetime, timedelta
+from tools.translate import _
+import logging
+import netsvc
+import pooler
+
+# Number of tries before a job is considered as failed
+MAX_ATTEMPTS = 3
+# Running jobs older than this are considered as lost by a stopped worker
+RUNNING_TIMEOUT = timedelta(hours=1)
+
+
+class stock_container_job(osv.osv):
+    _name = 'stock.container.job'
+    _description = 'Container Transition Job'
+    _rec_name = 'signal'
+    _order = 'id'
+
+    _columns = {
+        'container_id': fields.many2one('stock.container', 'Container', required=True, readonly=True, ondelete='cascade', select=True, help='Container on which the transition is applied'),
+        'signal': fields.char('Signal', size=64, required=True, readonly=True, help='Workflow signal sent to the container'),
+        'user_id': fields.many2one('res.users', 'User', required=True, readonly=True, help='User who asked for the transition'),
+        'state': fields.selection([
+            ('pending', 'Pending'),
+            ('running', 'Running'),
+            ('done', 'Done'),
+            ('failed', 'Failed'),
+        ], 'Status', required=True, readonly=True, select=True, help='Status of the transition'),
+        'attempts': fields.integer('Attempts', readonly=True, help='Number of times the transition has been tried'),
+        'date_start': fields.datetime('Start Date', readonly=True, help='Date of the last try'),
+        'date_done': fields.datetime('Done Date', readonly=True, help='Date at which the transition has been applied'),
+        'error': fields.text('Error', readonly=True, help='Error raised by the last try'),
+    }
+
+    _defaults = {
+        'state': 'pending',
+        'attempts': 0,
+        'user_id': lambda self, cr, uid, context: uid,
+    }
+
+    def enqueue(self, cr, uid, container_ids, signal, context=None):
+        """
+        Queue the signal for the containers, unless it is already waiting
+        """
+        job_ids = []
+        for container_id in container_ids:
+            pending_ids = self.search(cr, uid, [('container_id', '=', container_id), ('signal', '=', signal), ('state', '=', 'pending')], context=context)
+            if pending_ids:
+                job_ids.extend(pending_ids)
+                continue
+            job_ids.append(self.create(cr, uid, {'container_id': container_id, 'signal': signal}, context=context))
+        return job_ids
+
+    def _run_jobs(self, cr, uid, context=None):
+        """
+        Run the pending jobs, each one in its own transaction
+        Jobs of a same container are run in order, one at a time
+        """
+        logger = logging.getLogger('container')
+        wf_service = netsvc.LocalService('workflow')
+        now = datetime.now()
+        # Give back the jobs lost by a stopped worker
+        cr.execute("UPDATE stock_container_job SET state = 'pending' WHERE state = 'running' AND date_start < %s", ((now - RUNNING_TIMEOUT).strftime('%Y-%m-%d %H:%M:%S'),))
+        cr.commit()
+        cr.execute("""
+            SELECT DISTINCT ON (container_id) id, container_id, signal, user_id, attempts
+            FROM stock_container_job job
+            WHERE state = 'pending'
+                AND NOT EXISTS (SELECT 1 FROM stock_container_job running WHERE running.container_id = job.container_id AND running.state = 'running')
+            ORDER BY container_id, id""")
+        for job_id, container_id, signal, user_id, attempts in cr.fetchall():
+            # Take the job, unless another worker already did
+            cr.execute("UPDATE stock_container_job SET state = 'running', date_start = %s WHERE id = %s AND state = 'pending'", (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), job_id))
+            if not cr.rowcount:
+                continue
+            cr.commit()
+            values = {'attempts': attempts + 1}
+            job_cr = pooler.get_db(cr.dbname).cursor()
+            try:
+                try:
+                    # Serialize the transitions of the container with the other workers and users
+                    job_cr.execute('SELECT state FROM stock_container WHERE id = %s FOR UPDATE NOWAIT', (container_id,))
+                    state = job_cr.fetchone()[0]
+                    wf_service.trg_validate(user_id, 'stock.container', container_id, signal, job_cr)
+                    job_cr.execute('SELECT state FROM stock_container WHERE id = %s', (container_id,))
+                    if job_cr.fetchone()[0] == state:
+                        # The signal doesn't apply to the current state, trying again won't change it
+                        job_cr.rollback()
+                        values.update(state='failed', error=_('The signal %s does not apply to a container in state %s !') % (signal, state))
+                    else:
+                        job_cr.commit()
+                        values.update(state='done', error=False, date_done=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+                except Exception as e:
+                    job_cr.rollback()
+                    logger.exception('Transition %s of container %s failed', signal, container_id)
+                    error = isinstance(e, osv.except_osv) and e.value or unicode(e)
+                    values.update(state=values['attempts'] < MAX_ATTEMPTS and 'pending' or 'failed', error=error)
+            finally:
+                job_cr.close()
+            self.write(cr, uid, [job_id], values, context=context)
+            cr.commit()
+        return True
+
+    def action_retry(self, cr, uid, ids, context=None):
+        """
+        Put failed jobs back in the queue
+        """
+        return self.write(cr, uid, [job.id for job in self.browse(cr, uid, ids, context=context) if job.state == 'failed'], {'state': 'pending', 'attempts': 0}, context=context)
+
+stock_container_job()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from osv import osv
+from osv import fields
+
+# States in which the container has not arrived yet
+NOT_ARRIVED_STATES = ('draft', 'booking', 'freight')
+
+
+class report_stock_container(osv.osv):
+    """
+    Containers statistics by warehouse, state and week of arrival
+    The table is filled by a cron, so the dashboard doesn't depend on the number of containers
+    """
+    _name = 'report.stock.container'
+    _description = 'Containers Statistics'
+    _rec_name = 'week'
+    _order = 'date desc, warehouse_id, state'
+
+    def _get_fill_rate(self, cr, uid, ids, field_name, arg, context=None):
+        """
+        Returns the volume of the contents versus the volume of the containers, in percent
+        """
+        res = {}
+        for report in self.read(cr, uid, ids, ['volume', 'capacity'], context=context):
+            res[report['id']] = report['capacity'] and report['volume'] * 100 / report['capacity'] or 0.
+        return res
+
+    _columns = {
+        'warehouse_id': fields.many2one('stock.warehouse', 'Warehouse', readonly=True, select=True),
+        'state': fields.selection([
+            ('draft', 'Draft'),
+            ('booking', 'Booking'),
+            ('freight', 'Freight'),
+            ('clearance', 'Clearance'),
+            ('approaching', 'Approaching'),
+            ('unpacking', 'Unpacking'),
+            ('delivered', 'Delivered'),
+            ('cancel', 'Cancel'),
+        ], 'Status', readonly=True, select=True),
+        'date': fields.date('Week Start', readonly=True, select=True, help='First day of the week of estimated arrival'),
+        'week': fields.char('Week', size=8, readonly=True, help='Year and week of estimated arrival'),
+        'container_count': fields.integer('Containers', readonly=True, group_operator='sum'),
+        'weight': fields.float('Weight', readonly=True),
+        'volume': fields.float('Volume', readonly=True),
+        'capacity': fields.float('Capacity', readonly=True, help='Total volume of the container products'),
+        'fill_rate': fields.function(_get_fill_rate, method=True, string='Fill Rate (%)', type='float', help='Volume of the contents versus volume of the containers, compare the volume and capacity totals for grouped lines'),
+        'late_count': fields.integer('Late', readonly=True, help='Containers not arrived yet whose estimated date of arrival is past'),
+    }
+
+    def init(self, cr):
+        """
+        Fill the table when installing or updating the module
+        """
+        self.refresh(cr, 1)
+
+    def refresh(self, cr, uid, context=None):
+        """
+        Compute the statistics again from the containers
+        """
+        cr.execute('DELETE FROM report_stock_container')
+        cr.execute("""
+            INSERT INTO report_stock_container (create_uid, create_date, warehouse_id, state, date, week, container_count, weight, volume, capacity, late_count)
+            SELECT %s, (now() at time zone 'UTC'), stats.warehouse_id, stats.state, stats.date, to_char(stats.date, 'IYYY-IW'),
+                stats.container_count, stats.weight, stats.volume, stats.capacity, stats.late_count
+            FROM (
+                SELECT container.destination_warehouse_id AS warehouse_id, container.state, date_trunc('week', container.eta_date)::date AS date,
+                    COUNT(*) AS container_count,
+                    SUM(COALESCE(container.weight, 0)) AS weight,
+                    SUM(COALESCE(container.volume, 0)) AS volume,
+                    SUM(COALESCE(template.volume, 0)) AS capacity,
+                    SUM(CASE WHEN container.state IN %s AND container.eta_date < current_date THEN 1 ELSE 0 END) AS late_count
+                FROM stock_container container
+                    JOIN product_product product ON product.id = container.product_id
+                    JOIN product_template template ON template.id = product.product_tmpl_id
+                GROUP BY container.destination_warehouse_id, container.state, date_trunc('week', container.eta_date)
+            ) stats""", (uid, NOT_ARRIVED_STATES))
+        return True
+
+report_stock_container()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+"""
+Build the indexes of the container columns concurrently on existing databases
+
+The models create the missing indexes when the module is updated, but a
+plain CREATE INDEX locks stock_move against writes for the whole build.
+Building them here, before the models are loaded, lets the update find
+them already existing.
+"""
+
+import logging
+import sql_db
+
+INDEXES = [
+    ('stock_move_container_product_sale_picking_index', 'stock_move', 'container_id, product_id, sale_line_id, picking_id'),
+    ('sale_order_line_container_id_index', 'sale_order_line', 'container_id'),
+    ('stock_container_move_rel_move_id_index', 'stock_container_move_rel', 'move_id'),
+]
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    logger = logging.getLogger('container')
+    missing_indexes = []
+    for name, table, columns in INDEXES:
+        cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', (name,))
+        if not cr.fetchone():
+            missing_indexes.append((name, table, columns))
+    if not missing_indexes:
+        return
+    # A concurrent build waits for all running transactions, including ours
+    cr.commit()
+    index_cr = sql_db.db_connect(cr.dbname).cursor()
+    index_cr.autocommit(True)
+    try:
+        for name, table, columns in missing_indexes:
+            logger.info('Creating index %s on %s (%s)', name, table, columns)
+            try:
+                index_cr.execute('CREATE INDEX CONCURRENTLY %s ON %s (%s)' % (name, table, columns))
+            except Exception:
+                # A failed concurrent build leaves an invalid index, the module update will build it again
+                logger.exception('Unable to create index %s concurrently', name)
+                index_cr.execute('DROP INDEX IF EXISTS %s' % name)
+    finally:
+        index_cr.close()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from osv import osv
+from osv import fields
+import weakref
+
+# Maximum number of products kept for a cursor
+CACHE_SIZE = 10000
+# Logistics values of the products, by cursor and product id
+_logistics_cache = weakref.WeakKeyDictionary()
+
+
+def get_product_logistics(cr, product_ids):
+    """
+    Returns the weight, volume, delays and container maximum load of the products, by product id
+    Values are cached for the cursor, so they are read once per request
+    """
+    cache = _logistics_cache.setdefault(cr, {})
+    if len(cache) + len(product_ids) > CACHE_SIZE:
+        cache.clear()
+    # Values are collected apart from the cache, which can be cleared by a product change meanwhile
+    res = {}
+    missing_ids = []
+    for product_id in set(product_ids):
+        values = cache.get(product_id)
+        if values is not None:
+            res[product_id] = values
+        elif product_id:
+            missing_ids.append(product_id)
+    for index in range(0, len(missing_ids), cr.IN_MAX):
+        cr.execute("""
+            SELECT product.id, template.weight_net, template.volume, template.produce_delay, template.sale_delay, template.container_max_weight
+            FROM product_product product
+                JOIN product_template template ON template.id = product.product_tmpl_id
+            WHERE product.id IN %s""", (tuple(missing_ids[index:index + cr.IN_MAX]),))
+        for product_id, weight_net, volume, produce_delay, sale_delay, container_max_weight in cr.fetchall():
+            res[product_id] = cache[product_id] = {
+                'weight_net': float(weight_net or 0.),
+                'volume': float(volume or 0.),
+                'produce_delay': float(produce_delay or 0.),
+                'sale_delay': float(sale_delay or 0.),
+                'container_max_weight': float(container_max_weight or 0.),
+            }
+    return res
+
+
+def invalidate_product_logistics(product_ids=None):
+    """
+    Removes the products from the caches of all cursors, or all products if none is given
+    """
+    for cache in list(_logistics_cache.values()):
+        if product_ids is None:
+            cache.clear()
+            continue
+        for product_id in product_ids:
+            cache.pop(product_id, None)
+
+
+class product_product(osv.osv):
+    _inherit = 'product.product'
+
+    def write(self, cr, uid, ids, values, context=None):
+        invalidate_product_logistics(isinstance(ids, (int, long)) and [ids] or ids)
+        return super(product_product, self).write(cr, uid, ids, values, context=context)
+
+    def unlink(self, cr, uid, ids, context=None):
+        invalidate_product_logistics(isinstance(ids, (int, long)) and [ids] or ids)
+        return super(product_product, self).unlink(cr, uid, ids, context=context)
+
+product_product()
+
+
+class product_template(osv.osv):
+    _inherit = 'product.template'
+
+    _columns = {
+        'container_max_weight': fields.float('Container Maximum Load', help='Maximum weight of the contents of a container using this product, 0 for no limit'),
+    }
+
+    def write(self, cr, uid, ids, values, context=None):
+        cr.execute('SELECT id FROM product_product WHERE product_tmpl_id IN %s', (tuple(isinstance(ids, (int, long)) and [ids] or ids),))
+        invalidate_product_logistics([row[0] for row in cr.fetchall()])
+        return super(product_template, self).write(cr, uid, ids, values, context=context)
+
+product_template()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from osv import osv
+from osv import fields
+from datetime import datetime
+import logging
+import pooler
+import psycopg2
+import psycopg2.extensions
+import time
+
+# Profiling flag of the users' companies, by database and user
+_enabled_cache = {}
+
+
+def _is_enabled(cr, uid, context):
+    """
+    Profiling is enabled by the context, or else by the company of the user
+    """
+    if context and 'container_profiling' in context:
+        return context['container_profiling']
+    key = (cr.dbname, uid)
+    if key not in _enabled_cache:
+        cr.execute('SELECT company.container_profiling FROM res_users users JOIN res_company company ON company.id = users.company_id WHERE users.id = %s', (uid,))
+        row = cr.fetchone()
+        _enabled_cache[key] = bool(row and row[0])
+    return _enabled_cache[key]
+
+
+def clear_cache():
+    """
+    Forget the profiling flags, after a change on companies or users
+    """
+    _enabled_cache.clear()
+
+
+def _rows_touched(cr):
+    """
+    Returns the number of rows inserted, updated and deleted by the current transaction
+    """
+    cr.execute('SELECT COALESCE(SUM(n_tup_ins + n_tup_upd + n_tup_del), 0) FROM pg_stat_xact_user_tables')
+    return cr.fetchone()[0]
+
+
+class query_counter(object):
+    """
+    Counts the queries run on a cursor between start and stop
+    The cursor's own counter is only maintained when SQL logging is enabled
+    """
+    def __init__(self, cr):
+        self.cr = cr
+        self.count = 0
+        self.previous = None
+
+    def _execute(self, *args, **kwargs):
+        self.count += 1
+        return self.execute(*args, **kwargs)
+
+    def start(self):
+        # Counters can be nested, each one calls the execute it replaced
+        self.previous = self.cr.__dict__.get('execute')
+        self.execute = self.cr.execute
+        self.cr.execute = self._execute
+        return self
+
+    def stop(self):
+        if self.previous is None:
+            del self.cr.execute
+        else:
+            self.cr.execute = self.previous
+        return self.count
+
+
+def profiled(get_container_ids=None):
+    """
+    Decorator recording the wall time, queries and rows touched by a method of the container module
+    get_container_ids(self, cr, uid, ids) returns the containers to which the call is accounted,
+    by default the ids given to the method
+    """
+    def decorator(method):
+        def wrapper(self, cr, uid, ids, *args, **kwargs):
+            if not _is_enabled(cr, uid, kwargs.get('context')):
+                return method(self, cr, uid, ids, *args, **kwargs)
+            rows = _rows_touched(cr)
+            counter = query_counter(cr).start()
+            start = time.time()
+            try:
+                res = method(self, cr, uid, ids, *args, **kwargs)
+            finally:
+                seconds = time.time() - start
+                queries = counter.stop()
+            rows = _rows_touched(cr) - rows
+            record_ids = isinstance(ids, (int, long)) and [ids] or ids
+            container_ids = record_ids
+            if get_container_ids:
+                container_ids = get_container_ids(self, cr, uid, record_ids)
+            self.pool.get('stock.container.profile').record(cr, uid, '%s.%s' % (self._name, method.__name__), container_ids, seconds, queries, rows)
+            return res
+        wrapper.__name__ = method.__name__
+        wrapper.__doc__ = method.__doc__
+        return wrapper
+    return decorator
+
+
+class stock_container_profile(osv.osv):
+    _name = 'stock.container.profile'
+    _description = 'Container Profile'
+    _rec_name = 'method'
+    _order = 'seconds desc'
+
+    _columns = {
+        'container_id': fields.many2one('stock.container', 'Container', readonly=True, ondelete='cascade', select=True, help='Container on which the method was called'),
+        'method': fields.char('Method', size=128, required=True, readonly=True, select=True, help='Profiled method'),
+        'calls': fields.integer('Calls', readonly=True, help='Number of calls of the method for this container'),
+        'seconds': fields.float('Seconds', readonly=True, help='Total wall time spent in the method'),
+        'queries': fields.integer('Queries', readonly=True, help='Total number of SQL queries run by the method'),
+        'rows': fields.integer('Rows', readonly=True, help='Total number of rows inserted, updated or deleted by the method'),
+        'last_date': fields.datetime('Last Call', readonly=True, help='Date of the last call of the method'),
+    }
+
+    _sql_constraints = [
+        ('container_method_uniq', 'unique (container_id, method)', 'A method can only be profiled once per container !'),
+    ]
+
+    def record(self, cr, uid, method, container_ids, seconds, queries, rows):
+        """
+        Logs a call of the method, and adds it to the totals of each container
+        Totals are written on their own cursor, committed for each container, so the locks on the
+        profile rows don't serialize the transactions calling the same methods on the same containers
+        Calls on containers not committed yet are only logged
+        """
+        logger = logging.getLogger('container.profiling')
+        logger.info('method=%s containers=%s seconds=%.3f queries=%d rows=%d', method, ','.join([str(container_id) for container_id in container_ids]), seconds, queries, rows)
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        profile_cr = pooler.get_db(cr.dbname).cursor()
+        try:
+            for container_id in container_ids:
+                # A concurrent first call inserts the same row, or a concurrent call updates it, the second try updates it
+                for attempt in range(2):
+                    try:
+                        profile_cr.execute("""
+                            UPDATE stock_container_profile
+                            SET calls = calls + 1, seconds = seconds + %s, queries = queries + %s, rows = rows + %s, last_date = %s
+                            WHERE container_id = %s AND method = %s""", (seconds, queries, rows, now, container_id, method))
+                        if not profile_cr.rowcount:
+                            profile_cr.execute("""
+                                INSERT INTO stock_container_profile (create_uid, create_date, container_id, method, calls, seconds, queries, rows, last_date)
+                                VALUES (%s, (now() at time zone 'UTC'), %s, %s, 1, %s, %s, %s, %s)""", (uid, container_id, method, seconds, queries, rows, now))
+                        profile_cr.commit()
+                        break
+                    except (psycopg2.IntegrityError, psycopg2.extensions.TransactionRollbackError):
+                        profile_cr.rollback()
+                else:
+                    logger.debug('Totals of method %s not recorded for container %s', method, container_id)
+        finally:
+            profile_cr.close()
+        return True
+
+stock_container_profile()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -27,6 +27,7 @@
 from osv import osv
 from osv import fields
 from tools.translate import _
+from profiling import profiled
 
 
 class sale_order(osv.osv):
@@ -37,9 +38,10 @@ class sale_order(osv.osv):
         Check if there is enough products available in lines' containers
         """
         res = super(sale_order, self).action_ship_create(cr, uid, ids, context)
+        line_ids = []
         for order in self.browse(cr, uid, ids, context=context):
-            for line in order.order_line:
-                line.check_container_availability(context=context)
+            line_ids.extend([line.id for line in order.order_line])
+        self.pool.get('sale.order.line').check_container_availability(cr, uid, line_ids, context=context)
         return res
 
 sale_order()
@@ -49,49 +51,107 @@ class sale_order_line(osv.osv):
     _inherit = 'sale.order.line'
 
     _columns = {
-        'container_id': fields.many2one('stock.container', 'Container', help='Container of this sale order line'),
+        'container_id': fields.many2one('stock.container', 'Container', select=True, help='Container of this sale order line'),
     }
 
+    def _get_line_containers(self, cr, uid, ids):
+        """
+        Returns the containers of the sale order lines
+        """
+        cr.execute('SELECT DISTINCT container_id FROM sale_order_line WHERE id IN %s AND container_id IS NOT NULL', (tuple(ids) or (0,),))
+        return [row[0] for row in cr.fetchall()]
+
+    @profiled(get_container_ids=_get_line_containers)
     def check_container_availability(self, cr, uid, ids, context=None):
         """
         Check if there is enough products available in selected containers and reserve if there is enough
         """
         move_obj = self.pool.get('stock.move')
-        for line in self.browse(cr, uid, ids, context=context):
-            if not line.container_id or not line.product_id:
-                continue
-            # Retrieve quantity available in container
-            move_ids = move_obj.search(cr, uid, [
-                ('picking_id', '=', False),
-                ('container_id', '=', line.container_id.id),
-                ('sale_line_id', '=', False),
-                ('product_id', '=', line.product_id.id),
-            ], context=context)
-            moves = move_obj.browse(cr, uid, move_ids, context=context)
-            if sum([move.product_qty for move in moves]) < line.product_uom_qty:
+        lines = [line for line in self.browse(cr, uid, ids, context=context) if line.container_id and line.product_id]
+        if not lines:
+            return True
+        # Retrieve the moves available in all containers at once
+        move_ids = move_obj.search(cr, uid, [
+            ('picking_id', '=', False),
+            ('container_id', 'in', list(set([line.container_id.id for line in lines]))),
+            ('sale_line_id', '=', False),
+            ('product_id', 'in', list(set([line.product_id.id for line in lines]))),
+        ], context=context)
+        moves_data = dict([(data['id'], data) for data in move_obj.read(cr, uid, move_ids, ['container_id', 'product_id', 'product_qty', 'move_dest_id', 'date_expected'], context=context)])
+        free_moves = {}
+        for move_id in move_ids:
+            data = moves_data[move_id]
+            free_moves.setdefault((data['container_id'][0], data['product_id'][0]), []).append({
+                'id': move_id,
+                'source_id': move_id,
+                'product_qty': data['product_qty'],
+                'move_dest_id': data['move_dest_id'] and data['move_dest_id'][0],
+                'date_expected': data['date_expected'],
+            })
+        dest_ids = list(set([data['move_dest_id'][0] for data in moves_data.values() if data['move_dest_id']]))
+        dest_moves_dest = dict([(data['id'], data['move_dest_id'] and data['move_dest_id'][0]) for data in move_obj.read(cr, uid, dest_ids, ['move_dest_id'], context=context)])
+        # Check against the moves just read, the availability table is only used to propose containers
+        free_qty = dict([(key, sum([move['product_qty'] for move in moves])) for key, moves in free_moves.items()])
+        # Plan all reservations in memory
+        move_values = {}
+        dest_values = {}
+        dest_copies = []
+        new_moves = []
+        for line in lines:
+            key = (line.container_id.id, line.product_id.id)
+            moves = free_moves.get(key, [])
+            if free_qty.get(key, 0.) < line.product_uom_qty:
                 raise osv.except_osv(_('Not enough quantity'), _('%s\nNot enough quantity in selected container') % line.product_id.id)
+            free_qty[key] -= line.product_uom_qty
             # Reserve products in container
             qty_to_reserve = line.product_uom_qty
-            for move in moves:
-                rest = qty_to_reserve - move.product_qty
+            line_move_id = line.move_ids and line.move_ids[0].id
+            while moves:
+                move = moves.pop(0)
+                rest = qty_to_reserve - move['product_qty']
+                if move['id']:
+                    values = move_values.setdefault(move['id'], {})
+                else:
+                    values = move
                 # The move has too much quantity
                 if rest < 0:
-                    # Split the move
-                    move_obj.copy(cr, uid, move.id, {'product_qty': -rest}, context=None)
-                    move_obj.write(cr, uid, [move.id], {'product_qty': qty_to_reserve}, context=context)
+                    # Split the move, the new move stays available in the container
+                    remaining_move = dict(move, id=False, product_qty=-rest, sale_line_id=False)
+                    new_moves.append(remaining_move)
+                    index = 0
+                    while index < len(moves) and moves[index]['date_expected'] >= move['date_expected']:
+                        index += 1
+                    moves.insert(index, remaining_move)
+                    move['product_qty'] = values['product_qty'] = qty_to_reserve
                     # Update his move_dest_id
-                    move_obj.copy(cr, uid, move.move_dest_id.id, {'product_qty': -rest}, context=None)
-                    move_obj.write(cr, uid, [move.move_dest_id.id], {'product_qty': qty_to_reserve, 'move_dest_id': line.move_ids and line.move_ids[0].id}, context=context)
-                else:
+                    if move['move_dest_id']:
+                        dest_copies.append((move['move_dest_id'], {'product_qty': -rest, 'move_dest_id': dest_moves_dest[move['move_dest_id']]}))
+                        dest_values.setdefault(move['move_dest_id'], {}).update({'product_qty': qty_to_reserve, 'move_dest_id': line_move_id})
+                elif move['move_dest_id']:
                     # Update the move_dest_id of the move
-                    move_obj.write(cr, uid, [move.move_dest_id.id], {'move_dest_id': line.move_ids and line.move_ids[0].id}, context=context)
+                    dest_values.setdefault(move['move_dest_id'], {})['move_dest_id'] = line_move_id
+                if move['move_dest_id']:
+                    dest_moves_dest[move['move_dest_id']] = line_move_id
                 # Set the sale_line_id on the move
-                move_obj.write(cr, uid, [move.id], {'sale_line_id': line.id}, context=context)
+                values['sale_line_id'] = line.id
                 # The move has not enough quantity, continue searching
                 if rest > 0:
                     qty_to_reserve = rest
+                    if not moves:
+                        raise osv.except_osv(_('Not enough quantity'), _('%s\nNot enough quantity in selected container') % line.product_id.id)
                     continue
                 break
+        # Apply the reservations with bulk creates and writes, availabilities are refreshed once at the end
+        ctx = dict(context or {}, container_no_availability=True)
+        move_obj._copy_bulk(cr, uid, dest_copies, context=ctx)
+        move_obj._copy_bulk(cr, uid, [(move['source_id'], {'product_qty': move['product_qty'], 'sale_line_id': move['sale_line_id']}) for move in new_moves], context=ctx)
+        ids_by_values = {}
+        for move_id, values in move_values.items() + dest_values.items():
+            ids_by_values.setdefault(tuple(sorted(values.items())), []).append(move_id)
+        for values, write_ids in ids_by_values.items():
+            move_obj.write(cr, uid, write_ids, dict(values), context=ctx)
+        self.pool.get('stock.container.availability').refresh(cr, uid, list(set([line.container_id.id for line in lines])), list(set([line.product_id.id for line in lines])), context=context)
+        return True
 
 sale_order_line()
 
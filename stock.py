@@ -25,21 +25,190 @@
 
 from osv import osv
 from osv import fields
+import netsvc
+
+# Fields of the moves stored in the container candidates
+CANDIDATE_FIELDS = ('state', 'picking_id', 'location_id', 'product_id')
+# Fields of the moves used by the container availabilities
+AVAILABILITY_FIELDS = ('container_id', 'product_id', 'product_qty', 'sale_line_id', 'picking_id')
 
 
 class stock_move(osv.osv):
     _inherit = 'stock.move'
 
+    def _get_container_candidate(self, cr, uid, ids, field_name, arg, context=None):
+        """
+        Returns True for the moves which can be loaded in a container
+        """
+        res = dict([(move_id, False) for move_id in ids])
+        cr.execute('SELECT move_id FROM stock_container_candidate WHERE move_id IN %s', (tuple(ids),))
+        res.update(dict([(row[0], True) for row in cr.fetchall()]))
+        return res
+
+    def _search_container_candidate(self, cr, uid, obj, name, args, context=None):
+        """
+        Searches the candidate moves of a location category, given as value
+        """
+        candidate_obj = self.pool.get('stock.container.candidate')
+        domain = []
+        for field_name, operator, value in args:
+            query, params = candidate_obj.get_candidates_query(categ_id=value or False)
+            domain.append(('id', 'inselect', (query, params)))
+        return domain
+
     _columns = {
         'container_id': fields.many2one('stock.container', 'Container', help='Container of this move'),
+        'container_candidate': fields.function(_get_container_candidate, fnct_search=_search_container_candidate, method=True, type='boolean', string='Container Candidate', help='Assigned incoming move which can be loaded in a container, searched by location category'),
     }
 
+    def _auto_init(self, cr, context=None):
+        """
+        Create the composite index used to search the available moves of containers
+        It also serves the searches on the container alone, so no single column index is kept
+        """
+        res = super(stock_move, self)._auto_init(cr, context=context)
+        cr.execute('DROP INDEX IF EXISTS stock_move_container_id_index')
+        cr.execute('SELECT indexname FROM pg_indexes WHERE indexname = %s', ('stock_move_container_product_sale_picking_index',))
+        if not cr.fetchone():
+            cr.execute('CREATE INDEX stock_move_container_product_sale_picking_index ON stock_move (container_id, product_id, sale_line_id, picking_id)')
+        return res
+
+    def _copy_bulk(self, cr, uid, copies, context=None):
+        """
+        Duplicates moves with batched inserts instead of one ORM copy per move
+        copies is a list of (move_id, values) tuples, values overriding the copied columns
+        Returns the ids of the new moves, in the same order as copies
+        """
+        if not copies:
+            return []
+        self.pool.get('ir.model.access').check(cr, uid, self._name, 'create')
+        cr.execute('SELECT column_name, data_type FROM information_schema.columns WHERE table_name = %s', (self._table,))
+        column_types = dict(cr.fetchall())
+        log_columns = ('id', 'create_uid', 'create_date', 'write_uid', 'write_date')
+        columns = [name for name, column in self._columns.items() if column._classic_write and name in column_types and name not in log_columns]
+        # Copies overriding the same columns are inserted together
+        copies_by_fields = {}
+        for index, (move_id, values) in enumerate(copies):
+            copies_by_fields.setdefault(tuple(sorted(values.keys())), []).append((index, move_id, values))
+        new_ids = [None] * len(copies)
+        for override_fields, field_copies in copies_by_fields.items():
+            cr.execute('SELECT nextval(%s) FROM generate_series(1, %s)', (self._sequence, len(field_copies)))
+            sequence_ids = [row[0] for row in cr.fetchall()]
+            rows = []
+            params = []
+            for sequence_id, (index, move_id, values) in zip(sequence_ids, field_copies):
+                new_ids[index] = sequence_id
+                rows.append('(%s)' % ', '.join(['CAST(%s AS integer)', 'CAST(%s AS integer)'] + ['CAST(%%s AS %s)' % column_types[name] for name in override_fields]))
+                params.extend([sequence_id, move_id])
+                for name in override_fields:
+                    value = values[name]
+                    # False means NULL for every non boolean column
+                    if value is False and column_types[name] != 'boolean':
+                        value = None
+                    params.append(value)
+            select_columns = []
+            for name in columns:
+                if name in override_fields:
+                    select_columns.append('duplicate.override_%d' % override_fields.index(name))
+                else:
+                    select_columns.append('move."%s"' % name)
+            query = 'INSERT INTO "%s" (id, create_uid, create_date, %s) ' % (self._table, ', '.join(['"%s"' % name for name in columns]))
+            query += 'SELECT duplicate.new_id, %%s, (now() at time zone \'UTC\'), %s ' % ', '.join(select_columns)
+            query += 'FROM (VALUES %s) AS duplicate (new_id, source_id%s) ' % (', '.join(rows), ''.join([', override_%d' % i for i in range(len(override_fields))]))
+            query += 'JOIN "%s" move ON move.id = duplicate.source_id' % self._table
+            cr.execute(query, [uid] + params)
+        # Initialize workflow instances, if a workflow is defined on moves
+        cr.execute('SELECT id FROM wkf WHERE osv = %s AND on_create = True', (self._name,))
+        if cr.fetchall():
+            wf_service = netsvc.LocalService('workflow')
+            for new_id in new_ids:
+                wf_service.trg_create(uid, self._name, new_id, cr)
+        # Compute stored function fields depending on the new moves
+        result = self._store_get_values(cr, uid, new_ids, columns, context)
+        result.sort()
+        done = []
+        for order, object, store_ids, fields2 in result:
+            if not (object, store_ids, fields2) in done:
+                self.pool.get(object)._store_set_values(cr, uid, store_ids, fields2, context)
+                done.append((object, store_ids, fields2))
+        self.pool.get('stock.container.candidate').refresh(cr, uid, new_ids, context=context)
+        self._refresh_availability(cr, uid, self._get_container_products(cr, uid, new_ids), context=context)
+        return new_ids
+
+    def _get_container_products(self, cr, uid, ids):
+        """
+        Returns the (container, product) keys of the moves which are in a container
+        """
+        keys = set()
+        for index in range(0, len(ids), cr.IN_MAX):
+            cr.execute('SELECT DISTINCT container_id, product_id FROM stock_move WHERE id IN %s AND container_id IS NOT NULL', (tuple(ids[index:index + cr.IN_MAX]),))
+            keys.update(cr.fetchall())
+        return keys
+
+    def _refresh_availability(self, cr, uid, keys, context=None):
+        """
+        Recompute the container availabilities of the (container, product) keys
+        Callers refreshing them once by themselves disable it with container_no_availability in context
+        """
+        if not keys or (context and context.get('container_no_availability')):
+            return True
+        availability_obj = self.pool.get('stock.container.availability')
+        container_ids_by_product = {}
+        for container_id, product_id in keys:
+            container_ids_by_product.setdefault(product_id, []).append(container_id)
+        for product_id, container_ids in container_ids_by_product.items():
+            availability_obj.refresh(cr, uid, container_ids, [product_id], context=context)
+        return True
+
+    def create(self, cr, uid, values, context=None):
+        move_id = super(stock_move, self).create(cr, uid, values, context=context)
+        self.pool.get('stock.container.candidate').refresh(cr, uid, [move_id], context=context)
+        if values.get('container_id'):
+            self._refresh_availability(cr, uid, self._get_container_products(cr, uid, [move_id]), context=context)
+        return move_id
+
+    def write(self, cr, uid, ids, values, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        availability_changes = [field_name for field_name in AVAILABILITY_FIELDS if field_name in values]
+        # Containers and products the moves leave are refreshed too
+        keys = availability_changes and self._get_container_products(cr, uid, ids) or set()
+        res = super(stock_move, self).write(cr, uid, ids, values, context=context)
+        if [field_name for field_name in CANDIDATE_FIELDS if field_name in values]:
+            self.pool.get('stock.container.candidate').refresh(cr, uid, ids, context=context)
+        if availability_changes:
+            self._refresh_availability(cr, uid, keys | self._get_container_products(cr, uid, ids), context=context)
+        return res
+
+    def unlink(self, cr, uid, ids, context=None):
+        if isinstance(ids, (int, long)):
+            ids = [ids]
+        keys = self._get_container_products(cr, uid, ids)
+        res = super(stock_move, self).unlink(cr, uid, ids, context=context)
+        self._refresh_availability(cr, uid, keys, context=context)
+        return res
+
 stock_move()
 
 
 class stock_picking(osv.osv):
     _inherit = 'stock.picking'
 
+    def update_min_date_from_moves(self, cr, uid, ids, context=None):
+        """
+        Sets the planned date of the pickings to the date of their latest move
+        """
+        if not ids:
+            return True
+        cr.execute('SELECT picking_id, MAX(date) FROM stock_move WHERE picking_id IN %s GROUP BY picking_id', (tuple(ids),))
+        # Group pickings by new date to write them all at once
+        picking_ids_by_date = {}
+        for picking_id, date in cr.fetchall():
+            picking_ids_by_date.setdefault(date[:10], []).append(picking_id)
+        for date, picking_ids in picking_ids_by_date.items():
+            self.write(cr, uid, picking_ids, {'min_date': date}, context=context)
+        return True
+
     def do_partial(self, cr, uid, ids, partial_datas, context=None):
         if context is None:
             context = {}
@@ -49,21 +218,50 @@ class stock_picking(osv.osv):
         if container_ids:
             move_obj = self.pool.get('stock.move')
             container_obj = self.pool.get('stock.container')
-            for container in container_obj.browse(cr, uid, container_ids, context=context):
-                for picking in self.browse(cr, uid, ids, context=context):
-                    # Check if backorder, if yes, we must remove this picking of container and change location_id in stock move
-                    if picking.backorder_id:
-                        #FIXME : if not find partner ??
-                        if picking.partner_id:
-                            loc_id = picking.partner_id.property_stock_supplier.id
-                            for move in picking.move_lines:
-                                move_obj.write(cr, uid, [move.id], {'location_id': loc_id}, context=context)
-                                container_obj.write(cr, uid, [container.id], {'incoming_move_list_ids': [(3, move.id)]}, context=context)
-                        for move_backorder in picking.backorder_id.move_lines:
-                            container_obj.write(cr, uid, [container.id], {'incoming_move_list_ids': [(4, move_backorder.id)]}, context=context)
+            move_ids_by_location = {}
+            commands = []
+            for picking in self.browse(cr, uid, ids, context=context):
+                # Check if backorder, if yes, we must remove this picking of container and change location_id in stock move
+                if picking.backorder_id:
+                    #FIXME : if not find partner ??
+                    if picking.partner_id:
+                        loc_id = picking.partner_id.property_stock_supplier.id
+                        move_ids_by_location.setdefault(loc_id, []).extend([move.id for move in picking.move_lines])
+                        commands.extend([(3, move.id) for move in picking.move_lines])
+                    commands.extend([(4, move_backorder.id) for move_backorder in picking.backorder_id.move_lines])
+            for loc_id, move_ids in move_ids_by_location.items():
+                move_obj.write(cr, uid, move_ids, {'location_id': loc_id}, context=context)
+            if commands:
+                # Container dates only depend on outgoing moves, no need to compute them again
+                container_obj.write(cr, uid, container_ids, {'incoming_move_list_ids': commands}, context=dict(context, container_no_dates=True))
+        return res
+
+    def write(self, cr, uid, ids, values, context=None):
+        res = super(stock_picking, self).write(cr, uid, ids, values, context=context)
+        if 'type' in values or 'address_id' in values:
+            move_ids = self.pool.get('stock.move').search(cr, uid, [('picking_id', 'in', isinstance(ids, (int, long)) and [ids] or ids)], context=context)
+            self.pool.get('stock.container.candidate').refresh(cr, uid, move_ids, context=context)
         return res
 
 stock_picking()
 
 
+class stock_location(osv.osv):
+    _inherit = 'stock.location'
+
+    def write(self, cr, uid, ids, values, context=None):
+        res = super(stock_location, self).write(cr, uid, ids, values, context=context)
+        if 'categ_id' in values:
+            # Only the category of the candidates changes
+            cr.execute("""
+                UPDATE stock_container_candidate candidate
+                SET categ_id = location.categ_id
+                FROM stock_move move
+                    JOIN stock_location location ON location.id = move.location_id
+                WHERE move.id = candidate.move_id AND location.id IN %s""", (tuple(isinstance(ids, (int, long)) and [ids] or ids),))
+        return res
+
+stock_location()
+
+
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
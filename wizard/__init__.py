@@ -23,5 +23,7 @@
 ##############################################################################
 
 import stock_partial_container
+import stock_container_transition
+import stock_container_import
 
 # vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
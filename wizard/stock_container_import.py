@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+
+from osv import osv
+from osv import fields
+from tools.translate import _
+from tools import ustr
+import base64
+import csv
+import tempfile
+
+# Number of manifest lines processed at once
+CHUNK_SIZE = 1000
+# Size of the base64 pieces decoded at once, multiple of 4
+DECODE_SIZE = 1 << 20
+# Columns of the manifest, quantity is optional
+MANIFEST_COLUMNS = ['sscc', 'picking', 'product', 'quantity']
+
+
+class stock_container_import(osv.osv_memory):
+    _name = 'stock.container.import'
+    _description = 'Container Manifest Import'
+
+    _columns = {
+        'data': fields.binary('Manifest', required=True, help='CSV file with the columns sscc, picking, product (code) and optionally quantity, one line per incoming move'),
+        'delimiter': fields.char('Delimiter', size=1, required=True, help='Field delimiter of the CSV file'),
+        'product_id': fields.many2one('product.product', 'Container Product', help='Product of the containers created by the import'),
+        'incoterm_id': fields.many2one('stock.incoterms', 'Incoterm', help='Incoterm of the containers created by the import'),
+        'container_stock_location_id': fields.many2one('stock.location', 'Container Stock Location', help='Stock location of the containers created by the import'),
+        'destination_warehouse_id': fields.many2one('stock.warehouse', 'Destination Warehouse', help='Destination warehouse of the containers created by the import'),
+        'partner_id': fields.many2one('res.partner', 'Freight Broker', help='Freight broker of the containers created by the import'),
+        'result': fields.text('Result', readonly=True),
+        'report': fields.binary('Error Report', readonly=True, help='CSV file of the manifest lines which were not imported'),
+        'report_name': fields.char('Report Name', size=64, readonly=True),
+    }
+
+    _defaults = {
+        'delimiter': ',',
+    }
+
+    def _decode(self, data):
+        """
+        Decodes the base64 manifest piece by piece, in a temporary file
+        """
+        manifest_file = tempfile.TemporaryFile()
+        pending = ''
+        for index in range(0, len(data), DECODE_SIZE):
+            pending += ''.join(data[index:index + DECODE_SIZE].split())
+            length = len(pending) - len(pending) % 4
+            manifest_file.write(base64.decodestring(pending[:length]))
+            pending = pending[length:]
+        manifest_file.seek(0)
+        return manifest_file
+
+    def _read_chunks(self, manifest_file, delimiter):
+        """
+        Yields the manifest lines by chunks, as lists of (line number, values dict)
+        """
+        reader = csv.reader(manifest_file, delimiter=str(delimiter))
+        header = [column.strip().lower() for column in reader.next()]
+        missing_columns = [column for column in MANIFEST_COLUMNS if column != 'quantity' and column not in header]
+        if missing_columns:
+            raise osv.except_osv(_('Error !'), _('Missing columns in the manifest : %s') % ', '.join(missing_columns))
+        chunk = []
+        for row in reader:
+            if not [value for value in row if value.strip()]:
+                continue
+            chunk.append((reader.line_num, dict([(column, value.strip()) for column, value in zip(header, row) if column in MANIFEST_COLUMNS])))
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _get_moves(self, cr, uid, picking_names, product_codes, context=None):
+        """
+        Returns the assigned incoming moves of the pickings on the products,
+        grouped by (picking name, product code), with the container in which they are listed
+        """
+        res = {}
+        cr.execute("""
+            SELECT move.id, picking.name, product.default_code, move.product_qty, location.categ_id, rel.container_id
+            FROM stock_move move
+                JOIN stock_picking picking ON picking.id = move.picking_id
+                JOIN product_product product ON product.id = move.product_id
+                JOIN stock_location location ON location.id = move.location_id
+                LEFT JOIN stock_container_move_rel rel ON rel.move_id = move.id
+            WHERE picking.type = 'in'
+                AND move.state = 'assigned'
+                AND picking.name IN %s
+                AND product.default_code IN %s
+            ORDER BY move.id""", (tuple(picking_names), tuple(product_codes)))
+        for move_id, picking_name, product_code, product_qty, categ_id, container_id in cr.fetchall():
+            res.setdefault((picking_name, product_code), []).append({
+                'id': move_id,
+                'product_qty': float(product_qty),
+                'categ_id': categ_id,
+                'container_id': container_id,
+            })
+        return res
+
+    def _import_chunk(self, cr, uid, wizard, chunk, used_move_ids, context=None):
+        """
+        Links the moves of the manifest lines to their containers, creating the missing containers
+        used_move_ids is the set of moves already matched by the previous lines of the manifest
+        Returns the list of (line number, line values, error) of the lines which were not imported
+        """
+        container_obj = self.pool.get('stock.container')
+        errors = []
+        lines = []
+        for line_number, line in chunk:
+            if not line.get('sscc') or not line.get('picking') or not line.get('product'):
+                errors.append((line_number, line, _('The sscc, picking and product are required')))
+                continue
+            try:
+                line['quantity'] = line.get('quantity') and float(line['quantity']) or False
+            except ValueError:
+                errors.append((line_number, line, _('Invalid quantity')))
+                continue
+            lines.append((line_number, line))
+        if not lines:
+            return errors
+        # Containers of the chunk, read at once
+        ssccs = list(set([line['sscc'] for line_number, line in lines]))
+        container_ids = container_obj.search(cr, uid, [('sscc', 'in', ssccs)], context=context)
+        containers = {}
+        for container in container_obj.read(cr, uid, container_ids, ['sscc', 'state', 'container_stock_location_id'], context=context):
+            containers.setdefault(container['sscc'], {
+                'id': container['id'],
+                'state': container['state'],
+                'location_id': container['container_stock_location_id'] and container['container_stock_location_id'][0],
+            })
+        # Moves of the chunk, read at once
+        moves = self._get_moves(cr, uid, set([line['picking'] for line_number, line in lines]), set([line['product'] for line_number, line in lines]), context=context)
+        move_ids_by_sscc = {}
+        for line_number, line in lines:
+            container = containers.get(line['sscc'])
+            if container and container['state'] != 'draft':
+                errors.append((line_number, line, _('The container is not in draft state')))
+                continue
+            location_id = container and container['location_id'] or wizard.container_stock_location_id.id
+            # Each move is only used by one line of the manifest
+            candidates = [move for move in moves.get((line['picking'], line['product']), []) if move['id'] not in used_move_ids]
+            # Same location restriction as the incoming move list domain
+            candidates = [move for move in candidates if not move['categ_id'] or move['categ_id'] == location_id]
+            if line['quantity']:
+                candidates = [move for move in candidates if abs(move['product_qty'] - line['quantity']) < 0.0001]
+            free_candidates = [move for move in candidates if not move['container_id']]
+            if not free_candidates:
+                if container and [move for move in candidates if move['container_id'] == container['id']]:
+                    errors.append((line_number, line, _('The incoming move is already in the container')))
+                else:
+                    errors.append((line_number, line, _('No available incoming move found')))
+                continue
+            move = free_candidates[0]
+            used_move_ids.add(move['id'])
+            move_ids_by_sscc.setdefault(line['sscc'], []).append((line_number, line, move['id']))
+        ctx = dict(context or {}, container_no_dates=True)
+        for sscc, sscc_lines in move_ids_by_sscc.items():
+            cr.execute('SAVEPOINT container_import')
+            try:
+                move_ids = [move_id for line_number, line, move_id in sscc_lines]
+                if sscc in containers:
+                    container_obj.write(cr, uid, [containers[sscc]['id']], {'incoming_move_list_ids': [(4, move_id) for move_id in move_ids]}, context=ctx)
+                else:
+                    if not wizard.product_id or not wizard.incoterm_id or not wizard.container_stock_location_id or not wizard.destination_warehouse_id:
+                        raise osv.except_osv(_('Error !'), _('The container does not exist, and the defaults to create it are not all filled'))
+                    container_obj.create(cr, uid, {
+                        'name': sscc,
+                        'sscc': sscc,
+                        'product_id': wizard.product_id.id,
+                        'incoterm_id': wizard.incoterm_id.id,
+                        'container_stock_location_id': wizard.container_stock_location_id.id,
+                        'destination_warehouse_id': wizard.destination_warehouse_id.id,
+                        'partner_id': wizard.partner_id.id,
+                        'incoming_move_list_ids': [(6, 0, move_ids)],
+                    }, context=ctx)
+                cr.execute('RELEASE SAVEPOINT container_import')
+            except Exception as e:
+                cr.execute('ROLLBACK TO SAVEPOINT container_import')
+                error = ustr(isinstance(e, osv.except_osv) and e.value or e)
+                errors.extend([(line_number, line, error) for line_number, line, move_id in sscc_lines])
+        return errors
+
+    def do_import(self, cr, uid, ids, context=None):
+        """
+        Imports the manifest chunk by chunk, and reports the lines which were not imported
+        """
+        wizard = self.browse(cr, uid, ids[0], context=context)
+        manifest_file = self._decode(wizard.data)
+        report_file = tempfile.TemporaryFile()
+        try:
+            writer = csv.writer(report_file)
+            writer.writerow(['line'] + MANIFEST_COLUMNS + ['error'])
+            line_count = 0
+            error_count = 0
+            used_move_ids = set()
+            for chunk in self._read_chunks(manifest_file, wizard.delimiter):
+                line_count += len(chunk)
+                for line_number, line, error in self._import_chunk(cr, uid, wizard, chunk, used_move_ids, context=context):
+                    error_count += 1
+                    writer.writerow([line_number] + [line.get(column) or '' for column in MANIFEST_COLUMNS] + [ustr(error).encode('utf-8')])
+            values = {
+                'result': _('%d lines imported, %d lines in error') % (line_count - error_count, error_count),
+                'report': False,
+                'report_name': False,
+            }
+            if error_count:
+                report_file.seek(0)
+                values.update(report=base64.encodestring(report_file.read()), report_name='manifest_errors.csv')
+        finally:
+            manifest_file.close()
+            report_file.close()
+        self.write(cr, uid, ids, values, context=context)
+        return {
+            'name': _('Import Manifest'),
+            'view_mode': 'form',
+            'view_type': 'form',
+            'res_model': self._name,
+            'res_id': ids[0],
+            'type': 'ir.actions.act_window',
+            'target': 'new',
+            'context': context,
+        }
+
+stock_container_import()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
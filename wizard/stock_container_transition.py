@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+##############################################################################
+#
+#    container module for OpenERP, Manages containers receipt
+#    Copyright (C) 2011 SYLEAM Info Services (<http://www.Syleam.fr/>)
+#              Sylvain Garancher <sylvain.garancher@syleam.fr>
+#
+#    This file is a part of container
+#
+#    container is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    container is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+
+from osv import osv
+from osv import fields
+from tools.translate import _
+
+# Signal moving a container to the next state, for the states a clerk can skip through
+NEXT_SIGNALS = [
+    ('freight', 'button_clearance'),
+    ('clearance', 'button_approach'),
+    ('approaching', 'button_unpack'),
+]
+STATES_ORDER = [state for state, signal in NEXT_SIGNALS] + ['unpacking']
+
+
+class stock_container_transition(osv.osv_memory):
+    _name = 'stock.container.transition'
+    _description = 'Container Mass Transition'
+
+    _columns = {
+        'state_to': fields.selection([
+            ('clearance', 'Clearance'),
+            ('approaching', 'Approaching'),
+            ('unpacking', 'Unpacking'),
+            ('cancel', 'Cancel'),
+        ], 'Target Status', required=True, help='Status in which the selected containers will be put'),
+        'result': fields.text('Result', readonly=True),
+    }
+
+    def _get_signals(self, state_from, state_to):
+        """
+        Returns the signals to send to go from a state to another
+        """
+        if state_to == 'cancel':
+            return ['button_cancel']
+        return [signal for state, signal in NEXT_SIGNALS[STATES_ORDER.index(state_from):STATES_ORDER.index(state_to)]]
+
+    def do_transition(self, cr, uid, ids, context=None):
+        """
+        Sends the signals to all selected containers, grouped by their current state
+        """
+        if context is None:
+            context = {}
+        container_obj = self.pool.get('stock.container')
+        wizard = self.browse(cr, uid, ids[0], context=context)
+        container_ids_by_state = {}
+        container_names = {}
+        errors = []
+        for container in container_obj.read(cr, uid, context.get('active_ids', []), ['name', 'state'], context=context):
+            container_names[container['id']] = container['name']
+            if wizard.state_to != 'cancel' and (container['state'] not in STATES_ORDER or STATES_ORDER.index(container['state']) >= STATES_ORDER.index(wizard.state_to)):
+                errors.append(_('%s : The container cannot go from %s to %s !') % (container['name'], container['state'], wizard.state_to))
+                continue
+            container_ids_by_state.setdefault(container['state'], []).append(container['id'])
+        for state, container_ids in container_ids_by_state.items():
+            signals = self._get_signals(state, wizard.state_to)
+            for container_id, error in container_obj.transition_batch(cr, uid, container_ids, signals, context=context):
+                errors.append('%s : %s' % (container_names[container_id], error))
+        if not errors:
+            return {'type': 'ir.actions.act_window_close'}
+        self.write(cr, uid, ids, {'result': '\n'.join(errors)}, context=context)
+        return {
+            'name': _('Mass Transition'),
+            'view_mode': 'form',
+            'view_type': 'form',
+            'res_model': self._name,
+            'res_id': ids[0],
+            'type': 'ir.actions.act_window',
+            'target': 'new',
+            'context': context,
+        }
+
+stock_container_transition()
+
+# vim:expandtab:smartindent:tabstop=4:softtabstop=4:shiftwidth=4:
@@ -23,7 +23,6 @@ from osv import osv
 from osv import fields
 from tools.translate import _
 import itertools
-import netsvc
 
 
 class stock_partial_container_line(osv.osv_memory):
@@ -78,25 +77,32 @@ class stock_partial_container(osv.osv_memory):
         """
         container_obj = self.pool.get('stock.container')
         move_obj = self.pool.get('stock.move')
-        wf_service = netsvc.LocalService("workflow")
         container_ids = context.get('active_ids', False)
         partial = self.browse(cr, uid, ids[0], context=context)
-        for container in container_obj.browse(cr, uid, container_ids, context=context):
-            moves_list = partial.move_ids
-            for move in moves_list:
-                #Adding a check whether any line has been added with new qty
-                if not move.move_id:
-                    raise osv.except_osv(_('Processing Error'), _('You cannot add any new move while validating the container, rather you can split the lines prior to validation!'))
-                if move.move_id.product_uom.id != move.product_uom.id:
-                    raise osv.except_osv(_('Processing Error'), _('You cannot change Unit of product!'))
-                move_obj.write(cr, uid, [move.move_id.id], {
-                    'product_qty': move.quantity,
-                    'date': partial.date,
-                    'state': 'done',
-                })
-                new_dates = container_obj.get_dates_from_moves(cr, uid, container.id, context=context)
-                container_obj.write(cr, uid, [container.id], new_dates, context=context)
-                wf_service.trg_validate(uid, 'stock.container', container.id, 'button_freight', cr)
+        if not partial.move_ids:
+            return {'type': 'ir.actions.act_window_close'}
+        # Group the moves by quantity to write them all at once
+        move_ids_by_qty = {}
+        for move in partial.move_ids:
+            #Adding a check whether any line has been added with new qty
+            if not move.move_id:
+                raise osv.except_osv(_('Processing Error'), _('You cannot add any new move while validating the container, rather you can split the lines prior to validation!'))
+            if move.move_id.product_uom.id != move.product_uom.id:
+                raise osv.except_osv(_('Processing Error'), _('You cannot change Unit of product!'))
+            move_ids_by_qty.setdefault(move.quantity, []).append(move.move_id.id)
+        for quantity, move_ids in move_ids_by_qty.items():
+            move_obj.write(cr, uid, move_ids, {
+                'product_qty': quantity,
+                'date': partial.date,
+                'state': 'done',
+            })
+        # Update each container once, after all of its moves are done
+        container_ids_by_dates = {}
+        for container_id, new_dates in container_obj.get_dates_from_moves_batch(cr, uid, container_ids, context=context).items():
+            container_ids_by_dates.setdefault(tuple(sorted(new_dates.items())), []).append(container_id)
+        for new_dates, dates_container_ids in container_ids_by_dates.items():
+            container_obj.write(cr, uid, dates_container_ids, dict(new_dates), context=context)
+        container_obj.send_signal(cr, uid, container_ids, 'button_freight', context=context)
         return {'type': 'ir.actions.act_window_close'}
 
 stock_partial_container()